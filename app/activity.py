@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import deque, namedtuple
+from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from config import settings
+from database import database_key
+from models import ActivityLog
+
+FEED_SIZE = 5
+BUFFER_SIZE = 50
+
+Activity = namedtuple("Activity", "created_at kind user_id order_id subject quantity status")
+
+# Per-process ring buffers of the latest entries, keyed by database URL: (expires, deque).
+# Primed from the table on read, then appended to as this worker's commits land; other
+# workers' entries only arrive by re-reading, so a buffer is re-primed after ACTIVITY_BUFFER_TTL.
+_buffers = {}
+_lock = threading.Lock()
+
+
+def _bind_key(db: Session):
+    return database_key(db.get_bind())
+
+
+def _to_activity(row):
+    return Activity(row.created_at, row.kind, row.user_id, row.order_id, row.subject, row.quantity, row.status)
+
+
+# Adds an entry to the caller's transaction; it reaches the buffer only on commit
+def record(db: Session, kind, subject="", quantity=None, user_id=None, order_id=None, status=None):
+    entry = Activity(datetime.now(), kind, user_id, order_id, subject, quantity, status)
+    db.add(ActivityLog(**entry._asdict()))
+    db.info.setdefault("pending_activity", []).append(entry)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish(session):
+    entries = session.info.pop("pending_activity", None)
+    if not entries:
+        return
+    with _lock:
+        cached = _buffers.get(_bind_key(session))
+        if cached is not None:
+            cached[1].extend(entries)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session):
+    session.info.pop("pending_activity", None)
+
+
+def recent(db: Session, limit=FEED_SIZE):
+    key = _bind_key(db)
+    with _lock:
+        cached = _buffers.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            return list(reversed(cached[1]))[:limit]
+
+    rows = db.query(ActivityLog).order_by(ActivityLog.id.desc()).limit(BUFFER_SIZE).all()
+    buffer = deque((_to_activity(row) for row in reversed(rows)), maxlen=BUFFER_SIZE)
+    with _lock:
+        _buffers[key] = (time.monotonic() + settings.ACTIVITY_BUFFER_TTL, buffer)
+    return list(reversed(buffer))[:limit]
+
+
+def recent_for_user(db: Session, user_id, limit=FEED_SIZE):
+    rows = (
+        db.query(ActivityLog)
+        .filter(ActivityLog.user_id == user_id)
+        .order_by(ActivityLog.id.desc())
+        .limit(limit)
+        .all()
+    )
+    return [_to_activity(row) for row in rows]
+
+
+def describe(entry):
+    if entry.kind == "sale":
+        return f"Sold {entry.quantity} units of {entry.subject} on {entry.created_at.strftime('%d %B %Y')}"
+    if entry.kind == "product":
+        return f"Added new product: {entry.subject}"
+    if entry.kind == "restock":
+        return f"Restocked {entry.quantity} units of {entry.subject}"
+    if entry.kind == "status":
+        if entry.order_id is None:
+            return f"{entry.subject} marked {entry.status}"
+        return f"Order #{entry.order_id} marked {entry.status}"
+    if entry.kind == "low_stock":
+        if entry.quantity is None:
+            return f"Low stock: {entry.subject} fell below their reorder level"
+        return f"Low stock: {entry.subject} ({entry.quantity} left)"
+    return entry.subject
+
+
+def describe_for_customer(entry):
+    if entry.kind == "sale":
+        return f"You purchased {entry.quantity} x {entry.subject} on {entry.created_at.strftime('%d %B %Y')}"
+    if entry.kind == "status":
+        return f"Order #{entry.order_id} is now {entry.status}"
+    return entry.subject
@@ -0,0 +1,243 @@
+import asyncio
+import threading
+import time
+from datetime import date, timedelta
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from config import settings
+from database import database_key
+from models import User, Product, Order, OrderItem
+
+DIMENSIONS = ("day", "week", "category", "brand", "customer")
+TIME_DIMENSIONS = ("day", "week")
+MEASURES = ("revenue", "units", "orders")
+
+
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def _as_date(value):
+    # SQLite's date() hands back text
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+class SalesRow:
+    __slots__ = ("key", "revenue", "units", "orders")
+
+    def __init__(self, key, revenue, units, orders):
+        self.key = key
+        self.revenue = revenue
+        self.units = units
+        self.orders = orders
+
+
+def _group_column(db: Session, dimension):
+    if dimension == "day":
+        return Order.date
+    if dimension == "week":
+        # Monday of the order's week; other dialects group by day and fold below
+        dialect = db.get_bind().dialect.name
+        if dialect == "mysql":
+            return func.subdate(Order.date, func.weekday(Order.date))
+        if dialect == "sqlite":
+            return func.date(Order.date, "-6 days", "weekday 1")
+        return Order.date
+    if dimension == "category":
+        return Product.category
+    if dimension == "brand":
+        return Product.brand
+    if dimension == "customer":
+        return User.username
+    raise ValueError(f"Unknown dimension: {dimension}")
+
+
+# Revenue, units and distinct orders per group, grouped in the database.
+# Time groups come back in date order, the others by revenue.
+def sales_summary(db: Session, dimension, date_from=None, date_to=None):
+    key = _group_column(db, dimension)
+    query = (
+        db.query(key, func.sum(OrderItem.quantity * func.coalesce(OrderItem.unit_price, Product.price)),
+                 func.sum(OrderItem.quantity), func.count(func.distinct(Order.id)))
+        .select_from(OrderItem)
+        .join(Order, Order.id == OrderItem.order_id)
+        .join(Product, Product.id == OrderItem.product_id)
+    )
+    if dimension == "customer":
+        query = query.join(User, User.id == Order.user_id)
+    if date_from is not None:
+        query = query.filter(Order.date >= date_from)
+    if date_to is not None:
+        query = query.filter(Order.date <= date_to)
+
+    groups = {}
+    for value, revenue, units, orders in query.filter(key.isnot(None)).group_by(key):
+        if dimension in TIME_DIMENSIONS:
+            value = _as_date(value)
+            if dimension == "week":
+                value = week_start(value)
+        # An order falls on a single day, so folding days into weeks keeps order counts exact
+        row = groups.get(value)
+        if row is None:
+            groups[value] = SalesRow(value, float(revenue or 0), int(units or 0), int(orders))
+        else:
+            row.revenue += float(revenue or 0)
+            row.units += int(units or 0)
+            row.orders += int(orders)
+
+    if dimension in TIME_DIMENSIONS:
+        return sorted(groups.values(), key=lambda row: row.key)
+    return sorted(groups.values(), key=lambda row: (-row.revenue, row.key))
+
+
+# Order items from the last ANALYTICS_WINDOW_DAYS as parallel NumPy arrays. Every dimension is
+# stored as integer codes into a label list, so a pivot is a bincount over the selected rows.
+class SalesCube:
+    def __init__(self, start, days, order_ids, quantities, revenue, product_ids, user_ids, products, usernames):
+        self.start = start
+        self.days = days
+        self.order_ids = order_ids
+        self.quantities = quantities
+        self.revenue = revenue
+        self.codes = {}
+        self.labels = {}
+
+        self.codes["day"] = days
+        self.labels["day"] = [start + timedelta(days=offset) for offset in range(int(days.max(initial=-1)) + 1)]
+
+        first_monday = week_start(start)
+        shift = (start - first_monday).days
+        self.codes["week"] = (days + shift) // 7
+        self.labels["week"] = [first_monday + timedelta(weeks=week) for week in range(int(self.codes["week"].max(initial=-1)) + 1)]
+
+        # products: {id: (category, brand)}; look attributes up through a dense id -> code table
+        size = max(max(products, default=0), int(product_ids.max(initial=0))) + 1
+        for position, dimension in enumerate(("category", "brand")):
+            labels = sorted({attributes[position] or "" for attributes in products.values()})
+            index = {label: code for code, label in enumerate(labels)}
+            table = np.zeros(size, dtype=np.int32)
+            for product_id, attributes in products.items():
+                table[product_id] = index[attributes[position] or ""]
+            self.codes[dimension] = table[product_ids]
+            self.labels[dimension] = labels
+
+        customers, self.codes["customer"] = np.unique(user_ids, return_inverse=True)
+        self.labels["customer"] = [usernames.get(int(user_id), "(deleted user)") for user_id in customers]
+
+    def __len__(self):
+        return len(self.order_ids)
+
+    def _selection(self, date_from, date_to):
+        mask = np.ones(len(self), dtype=bool)
+        if date_from is not None:
+            mask &= self.days >= (date_from - self.start).days
+        if date_to is not None:
+            mask &= self.days <= (date_to - self.start).days
+        return mask
+
+    # {"rows": labels, "columns": labels or None, "values": [[...]]} with empty rows and columns dropped
+    def pivot(self, rows, columns=None, measure="revenue", date_from=None, date_to=None):
+        if rows not in DIMENSIONS or (columns is not None and columns not in DIMENSIONS):
+            raise ValueError("Unknown dimension")
+        if measure not in MEASURES:
+            raise ValueError(f"Unknown measure: {measure}")
+        mask = self._selection(date_from, date_to)
+        row_count = len(self.labels[rows])
+        column_count = len(self.labels[columns]) if columns else 1
+        cells = self.codes[rows][mask].astype(np.int64) * column_count
+        if columns:
+            cells += self.codes[columns][mask]
+
+        if measure == "orders":
+            # Distinct (cell, order) pairs, then count them per cell
+            order_ids = self.order_ids[mask].astype(np.int64)
+            stride = int(order_ids.max(initial=0)) + 1
+            pairs = np.unique(cells * stride + order_ids)
+            values = np.bincount(pairs // stride, minlength=row_count * column_count)
+        else:
+            weights = self.revenue[mask] if measure == "revenue" else self.quantities[mask]
+            values = np.bincount(cells, weights=weights, minlength=row_count * column_count)
+        values = values.reshape(row_count, column_count)
+
+        keep_rows = np.flatnonzero(values.any(axis=1))
+        keep_columns = np.flatnonzero(values.any(axis=0))
+        values = values[np.ix_(keep_rows, keep_columns)]
+        values = values.round(2) if measure == "revenue" else values.astype(np.int64)
+        return {
+            "rows": [self.labels[rows][code] for code in keep_rows],
+            "columns": [self.labels[columns][code] for code in keep_columns] if columns else None,
+            "values": values.tolist() if columns else values[:, 0].tolist(),
+        }
+
+
+def load_sales_cube(db: Session, today=None, window_days=None):
+    today = today or date.today()
+    start = today - timedelta(days=(window_days or settings.ANALYTICS_WINDOW_DAYS) - 1)
+    stmt = (
+        select(Order.date, Order.id, func.coalesce(Order.user_id, 0), OrderItem.product_id, OrderItem.quantity,
+               OrderItem.quantity * func.coalesce(OrderItem.unit_price, Product.price))
+        .join(Order, Order.id == OrderItem.order_id)
+        .join(Product, Product.id == OrderItem.product_id)
+        .where(Order.date >= start, Order.date <= today)
+    )
+    start_ordinal = start.toordinal()
+    chunks = []
+    # Straight off the connection: ORM result processing would double the load time
+    for partition in db.connection().execute(stmt.execution_options(yield_per=50000)).partitions():
+        day, order_id, user_id, product_id, quantity, revenue = zip(*partition)
+        chunks.append((
+            np.fromiter((value.toordinal() - start_ordinal for value in map(_as_date, day)), np.int32, len(day)),
+            np.array(order_id, dtype=np.int64),
+            np.array(user_id, dtype=np.int64),
+            np.array(product_id, dtype=np.int64),
+            np.array(quantity, dtype=np.int64),
+            np.array(revenue, dtype=np.float64),
+        ))
+    if chunks:
+        days, order_ids, user_ids, product_ids, quantities, revenue = (np.concatenate(column) for column in zip(*chunks))
+    else:
+        days, order_ids, user_ids, product_ids, quantities = (np.zeros(0, dtype=np.int64) for _ in range(5))
+        revenue = np.zeros(0, dtype=np.float64)
+
+    products = {row[0]: (row[1], row[2]) for row in db.execute(select(Product.id, Product.category, Product.brand))}
+    customers = np.unique(user_ids).tolist()
+    usernames = dict(db.execute(select(User.id, User.username).where(User.id.in_(customers))).all()) if customers else {}
+    return SalesCube(start, days, order_ids, quantities, revenue, product_ids, user_ids, products, usernames)
+
+
+# Built cubes per database, rebuilt once older than ANALYTICS_CACHE_TTL or when the day rolls over
+_cubes = {}
+_cubes_lock = threading.Lock()
+# Builds in flight per database; concurrent requests for a stale cube await the same one
+_builds = {}
+
+
+def _build(bind, key, today):
+    with Session(bind) as db:
+        cube = load_sales_cube(db, today)
+    with _cubes_lock:
+        _cubes[key] = (time.monotonic() + settings.ANALYTICS_CACHE_TTL, today, cube)
+    return cube
+
+
+# The load is seconds of queries and NumPy work, so it runs in a worker thread on its own
+# sync session (bind is a sync engine) and never on the event loop
+async def sales_cube(bind):
+    key = database_key(bind)
+    today = date.today()
+    with _cubes_lock:
+        cached = _cubes.get(key)
+    if cached and cached[0] > time.monotonic() and cached[1] == today:
+        return cached[2]
+    build = _builds.get(key)
+    if build is None or build.get_loop() is not asyncio.get_running_loop():
+        build = _builds[key] = asyncio.ensure_future(asyncio.to_thread(_build, bind, key, today))
+        build.add_done_callback(lambda done: _builds.pop(key, None) if _builds.get(key) is done else None)
+    # A cancelled request must not cancel the build the others are waiting on
+    return await asyncio.shield(build)
+
+
+def clear_cache():
+    with _cubes_lock:
+        _cubes.clear()
@@ -0,0 +1,188 @@
+import hashlib
+from decimal import Decimal
+import orjson
+from fastapi import APIRouter, Depends, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db, get_read_db, database_key
+from identity import resolve_identity
+from models import Product, Order
+from pagination import paginate_products, parse_date, PAGE_SIZE, SORT_OPTIONS, DEFAULT_SORT
+from pricing import price_cart
+from queries import fetch_order_page
+import catalog_cache
+
+# Versioned JSON API over the same models and queries as the HTML pages
+router = APIRouter(prefix="/api/v1")
+
+# fields= names. Products select only the requested columns, and orders leave out the joins for
+# "items" and "username" when those are not requested. Cart lines always load in full: the totals
+# need every line's price and quantity, and the other columns come from the same product join
+PRODUCT_FIELDS = {
+    "id": Product.id,
+    "category": Product.category,
+    "subcategory": Product.subcategory,
+    "brand": Product.brand,
+    "desc": Product.desc,
+    "price": Product.price,
+    "quantity": Product.quantity,
+    "date": Product.date,
+}
+CART_LINE_FIELDS = ("id", "product_id", "subcategory", "brand", "desc", "price", "quantity", "line_total")
+ORDER_FIELDS = ("id", "user_id", "username", "date", "status", "item_count", "total_amount", "items")
+ORDER_ITEM_FIELDS = ("product_id", "subcategory", "brand", "quantity", "unit_price")
+
+
+class InvalidFields(ValueError):
+    pass
+
+
+# "id,price" -> ["id", "price"] in the requested order; empty means every field
+def parse_fields(value, allowed):
+    if not value:
+        return list(allowed)
+    fields = list(dict.fromkeys(name.strip() for name in value.split(",") if name.strip()))
+    unknown = [name for name in fields if name not in allowed]
+    if unknown:
+        raise InvalidFields(f"unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def _default(value):
+    # Cart money is Decimal; a string keeps it exact
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError
+
+
+def dumps(content):
+    return orjson.dumps(content, default=_default)
+
+
+def etag(body):
+    return '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+
+
+# If-None-Match may list several tags or "*"; GET compares them weakly
+def not_modified(request, tag):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(candidate.strip().removeprefix("W/") == tag for candidate in header.split(","))
+
+
+# Serialized body with an ETag over its bytes; 304 when the client already has them
+def json_response(request, body):
+    headers = {"ETag": etag(body), "Cache-Control": "private, no-cache"}
+    if not_modified(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def error(status_code, message):
+    return Response(dumps({"error": message}), status_code=status_code, media_type="application/json")
+
+
+def _paging(page):
+    return {"next": page.next_cursor, "prev": page.prev_cursor, "limit": page.limit}
+
+
+async def _identity(user, db):
+    return await db.run_sync(lambda session: resolve_identity(user, session))
+
+
+@router.get("/products")
+async def list_products(request: Request, fields: str = "", sort: str = DEFAULT_SORT, after: str = "", before: str = "",
+                        limit: int = PAGE_SIZE, db: AsyncSession = Depends(get_read_db)):
+    try:
+        selected = parse_fields(fields, PRODUCT_FIELDS)
+    except InvalidFields as e:
+        return error(400, str(e))
+    if sort not in SORT_OPTIONS:
+        sort = DEFAULT_SORT
+
+    # Same catalog version and parameters give the same bytes, so the query runs once per version
+    key = ("api/products", database_key(db.bind.sync_engine), await catalog_cache.version(db), tuple(selected), sort,
+           after, before, limit)
+    body = catalog_cache.fragment_cache.get(key)
+    if body is None:
+        # Cursors are built from id (and date when sorting by it), requested or not
+        columns = list(dict.fromkeys(selected + ["id"] + (["date"] if "date" in sort else [])))
+
+        def page(session):
+            query = session.query(*(PRODUCT_FIELDS[name] for name in columns))
+            return paginate_products(query, sort=sort, after=after, before=before, limit=limit)
+
+        products = await db.run_sync(page)
+        body = dumps({
+            "items": [{name: getattr(row, name) for name in selected} for row in products],
+            "sort": products.sort,
+            **_paging(products),
+        })
+        catalog_cache.fragment_cache.put(key, body)
+    return json_response(request, body)
+
+
+@router.get("/products/{product_id}")
+async def get_product(request: Request, product_id: int, fields: str = "", db: AsyncSession = Depends(get_read_db)):
+    try:
+        selected = parse_fields(fields, PRODUCT_FIELDS)
+    except InvalidFields as e:
+        return error(400, str(e))
+    row = (await db.execute(select(*(PRODUCT_FIELDS[name] for name in selected)).where(Product.id == product_id))).first()
+    if row is None:
+        return error(404, f"product {product_id} not found")
+    return json_response(request, dumps(dict(zip(selected, row))))
+
+
+@router.get("/cart")
+async def get_cart(request: Request, user: str, fields: str = "", db: AsyncSession = Depends(get_db)):
+    try:
+        selected = parse_fields(fields, CART_LINE_FIELDS)
+    except InvalidFields as e:
+        return error(400, str(e))
+    context = await _identity(user, db)
+    if not context:
+        return error(404, f"user '{user}' not found")
+
+    cart = await db.run_sync(price_cart, context["id"])
+    return json_response(request, dumps({
+        "lines": [{name: getattr(line, name) for name in selected} for line in cart.lines],
+        "units": cart.units,
+        "subtotal": cart.subtotal,
+        "gst_percent": cart.gst_percent,
+        "gst": cart.gst,
+        "shipping": cart.shipping,
+        "total": cart.total,
+    }))
+
+
+# Customers get their own orders, admins everyone's; newest first
+@router.get("/orders")
+async def list_orders(request: Request, user: str, fields: str = "", status: str = "", after: str = "", before: str = "",
+                      limit: int = PAGE_SIZE, date_from: str = "", date_to: str = "", db: AsyncSession = Depends(get_read_db)):
+    try:
+        selected = parse_fields(fields, ORDER_FIELDS)
+    except InvalidFields as e:
+        return error(400, str(e))
+    context = await _identity(user, db)
+    if not context:
+        return error(404, f"user '{user}' not found")
+
+    criteria = [] if context["role"] == "admin" else [Order.user_id == context["id"]]
+    if status:
+        criteria.append(Order.status == status)
+    orders = await db.run_sync(lambda session: fetch_order_page(
+        session, *criteria, after=after, before=before, limit=limit, date_from=parse_date(date_from),
+        date_to=parse_date(date_to), with_items="items" in selected, with_username="username" in selected))
+
+    def order_fields(order):
+        return {
+            name: [{field: getattr(item, field) for field in ORDER_ITEM_FIELDS} for item in order.items]
+            if name == "items" else getattr(order, name)
+            for name in selected
+        }
+
+    return json_response(request, dumps({"items": [order_fields(order) for order in orders], **_paging(orders)}))
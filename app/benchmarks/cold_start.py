@@ -0,0 +1,80 @@
+# Measures how long a worker takes to become useful after it is started.
+#
+#   cd app && python benchmarks/cold_start.py
+#   cd app && python benchmarks/cold_start.py --database-url mysql+pymysql://... --precompile-templates
+#
+# Prints one JSON document with medians over --repeat fresh processes:
+#   import_seconds      `import main` alone (no database is contacted)
+#   ready_seconds       process start until /readyz answers 200
+#   startup_seconds     the lifespan initialization part of that, as reported by /readyz
+#   first_page_ms       the first login page rendered by the new worker
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from common import APP_DIR, git_commit, spawn_server
+
+IMPORT_SNIPPET = "import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)"
+
+
+def time_import(env):
+    result = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=APP_DIR, env={**os.environ, **env},
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def time_ready(port, env):
+    import httpx
+
+    started = time.perf_counter()
+    server = spawn_server(port, env)
+    try:
+        ready = time.perf_counter() - started
+        startup = httpx.get(f"http://127.0.0.1:{port}/readyz").json()["startup_seconds"]
+        page_started = time.perf_counter()
+        httpx.get(f"http://127.0.0.1:{port}/login")
+        first_page = time.perf_counter() - page_started
+    finally:
+        server.terminate()
+        server.wait()
+    return ready, startup, first_page
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--database-url", default="sqlite:///./bench_cold_start.db")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--precompile-templates", action="store_true")
+    parser.add_argument("--skip-migrations", action="store_true", help="start workers with RUN_MIGRATIONS=0")
+    args = parser.parse_args()
+
+    os.chdir(APP_DIR)
+    env = {
+        "DATABASE_URL": args.database_url,
+        "PRECOMPILE_TEMPLATES": "1" if args.precompile_templates else "0",
+        "RUN_MIGRATIONS": "0" if args.skip_migrations else "1",
+    }
+    imports = [time_import(env) for _ in range(args.repeat)]
+    runs = [time_ready(args.port, env) for _ in range(args.repeat)]
+
+    report = {
+        "commit": git_commit(),
+        "database": args.database_url.split(":", 1)[0],
+        "precompile_templates": args.precompile_templates,
+        "run_migrations": not args.skip_migrations,
+        "repeat": args.repeat,
+        "import_seconds": round(statistics.median(imports), 3),
+        "ready_seconds": round(statistics.median(run[0] for run in runs), 3),
+        "startup_seconds": round(statistics.median(run[1] for run in runs), 3),
+        "first_page_ms": round(statistics.median(run[2] for run in runs) * 1000, 2),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# Helpers shared by the benchmark scripts; each script puts the app directory on sys.path first.
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Database names that mark a server database as disposable (e.g. "shop_bench", "scratch")
+SCRATCH_MARKERS = ("bench", "scratch")
+
+
+# Guard for the scripts that drop and re-create every table: a SQLite file or a database named
+# as a scratch/bench one is fine, anything else needs --drop on the command line
+def ensure_disposable(database_url, drop=False):
+    from sqlalchemy.engine import make_url
+
+    url = make_url(database_url)
+    if drop or url.get_backend_name() == "sqlite" or any(marker in (url.database or "").lower() for marker in SCRATCH_MARKERS):
+        return
+    sys.exit(f"Refusing to drop the tables in {url.render_as_string(hide_password=True)}: its name has none of "
+             f"{', '.join(SCRATCH_MARKERS)}. Pass --drop if this database really is disposable.")
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def summarize(samples):
+    return {
+        "requests": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 2) if samples else None,
+        "p95_ms": round(percentile(samples, 95) * 1000, 2) if samples else None,
+        "p99_ms": round(percentile(samples, 99) * 1000, 2) if samples else None,
+        "mean_ms": round(statistics.mean(samples) * 1000, 2) if samples else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# uvicorn on a thread of this process; simple, but the load generator shares its GIL
+def start_server(port):
+    import uvicorn
+    import main
+
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+# uvicorn in its own process(es), so client threads do not compete with the app for the GIL.
+# Returns once /readyz reports the app started and the database reachable
+def spawn_server(port, env, workers=1, timeout=120):
+    import httpx
+
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=APP_DIR, env={"SECRET_KEY": "benchmark-only", **os.environ, **env},
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with status {process.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/readyz", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.05)
+    process.terminate()
+    raise RuntimeError("server did not start in time")
@@ -0,0 +1,201 @@
+# Concurrent HTTP load test over the main customer and admin pages.
+#
+#   cd app && python benchmarks/dataset.py --scale 10k                   # once per scale
+#   cd app && python benchmarks/load_test.py --output results/$(git rev-parse --short HEAD).json
+#   cd app && python benchmarks/load_test.py --base-url http://staging:8000 --routes browse,search
+#
+# Without --base-url the app is started with uvicorn against --database-url. Each route is driven
+# on its own for --duration seconds by --concurrency clients, so the numbers per route are not
+# mixed with other traffic. Prints (and optionally writes) one JSON document per run.
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+from common import APP_DIR, ensure_disposable, git_commit, spawn_server, summarize
+
+
+# name -> (method, path); the request itself is built per client by build_request
+ROUTES = {
+    "browse": ("GET", "/browse-products"),
+    "search": ("GET", "/view-products"),
+    "dashboard": ("GET", "/dashboard"),
+    "my_cart": ("GET", "/my-cart"),
+    "confirm_buy": ("POST", "/confirm-buy"),
+    "sales_history": ("GET", "/sales-history"),
+    "api_products": ("GET", "/api/v1/products"),
+    "api_cart": ("GET", "/api/v1/cart"),
+    "api_orders": ("GET", "/api/v1/orders"),
+}
+# fields= used for the JSON routes: what a product list / order list screen would show
+API_FIELDS = {"api_products": "id,brand,subcategory,price", "api_orders": "id,date,status,item_count,total_amount"}
+
+
+class Client:
+    def __init__(self, base_url, index, concurrency, scale):
+        import httpx
+        from dataset import SCALES
+
+        self.http = httpx.Client(base_url=base_url, timeout=30, follow_redirects=False)
+        self.index = index
+        sizes = SCALES[scale]
+        # Each client owns a disjoint slice of the customers with carts, so checkouts do not collide
+        self.customers = itertools.cycle(range(index, sizes["carts"], concurrency) or [index])
+        self.products = sizes["products"]
+        self.counter = itertools.count(index)
+
+    def close(self):
+        self.http.close()
+
+    def _customer(self):
+        from dataset import customer_name
+        return customer_name(next(self.customers))
+
+    def prepare(self, route):
+        # Untimed setup a request needs; /confirm-buy needs something in the cart
+        if route == "confirm_buy":
+            from dataset import in_stock
+            customer = self._customer()
+            product = next(self.counter) % self.products + 1
+            while not in_stock(product):
+                product = next(self.counter) % self.products + 1
+            self.http.post("/add-to-cart", data={"user": customer, "product_id": str(product), "quantity": "1"})
+            return {"data": {"user": customer}}
+        if route == "search":
+            from dataset import SEARCH_TERMS
+            return {"params": {"user": self._customer(), "search": SEARCH_TERMS[next(self.counter) % len(SEARCH_TERMS)]}}
+        if route in API_FIELDS:
+            return {"params": {"user": self._customer(), "fields": API_FIELDS[route]}}
+        if route in ("dashboard", "sales_history"):
+            from dataset import ADMIN
+            return {"params": {"user": ADMIN}}
+        return {"params": {"user": self._customer()}}
+
+
+def drive(route, clients, duration):
+    import httpx
+
+    method, path = ROUTES[route]
+    samples, errors, statuses, sizes = [], [0], {}, []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def run(client):
+        local, failed, codes, body_sizes = [], 0, {}, []
+        while time.monotonic() < deadline:
+            try:
+                request = client.prepare(route)
+            except httpx.HTTPError:
+                failed += 1
+                codes[None] = codes.get(None, 0) + 1
+                continue
+            started = time.perf_counter()
+            try:
+                response = client.http.request(method, path, **request)
+                code = response.status_code
+                body_sizes.append(len(response.content))
+            except httpx.HTTPError:
+                code = None
+            elapsed = time.perf_counter() - started
+            codes[code] = codes.get(code, 0) + 1
+            if code is None or code >= 400:
+                failed += 1
+            else:
+                local.append(elapsed)
+        with lock:
+            samples.extend(local)
+            sizes.extend(body_sizes)
+            errors[0] += failed
+            for code, count in codes.items():
+                statuses[str(code)] = statuses.get(str(code), 0) + count
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=run, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    result = {"method": method, "path": path, **summarize(samples)}
+    result["errors"] = errors[0]
+    result["throughput_rps"] = round(len(samples) / elapsed, 1)
+    result["statuses"] = statuses
+    result["bytes_mean"] = round(sum(sizes) / len(sizes)) if sizes else None
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--database-url", default="sqlite:///./bench.db", help="used when starting the server")
+    parser.add_argument("--base-url", default="", help="test a running server instead of starting one")
+    parser.add_argument("--scale", default="10k", help="scale the dataset was generated at (see dataset.py)")
+    parser.add_argument("--generate", action="store_true", help="regenerate the dataset before the run")
+    parser.add_argument("--routes", default=",".join(ROUTES), help="comma-separated subset of: " + ", ".join(ROUTES))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per route")
+    parser.add_argument("--warmup", type=float, default=1.0, help="untimed seconds per route first")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--output", default="", help="also write the JSON report here")
+    parser.add_argument("--drop", action="store_true", help="with --generate, allow a database not named as a bench/scratch one")
+    args = parser.parse_args()
+
+    routes = [route.strip() for route in args.routes.split(",") if route.strip()]
+    unknown = [route for route in routes if route not in ROUTES]
+    if unknown:
+        parser.error(f"unknown routes: {', '.join(unknown)}")
+
+    os.chdir(APP_DIR)
+    sys.path.insert(0, APP_DIR)
+    if args.generate:
+        ensure_disposable(args.database_url, args.drop)
+        os.environ["DATABASE_URL"] = args.database_url
+        from database import engine
+        from dataset import generate
+        generate(engine, args.scale)
+
+    server = None
+    base_url = args.base_url
+    if not base_url:
+        server = spawn_server(args.port, {"DATABASE_URL": args.database_url}, workers=args.workers)
+        base_url = f"http://127.0.0.1:{args.port}"
+
+    clients = [Client(base_url, index, args.concurrency, args.scale) for index in range(args.concurrency)]
+    report = {
+        "commit": git_commit(),
+        "scale": args.scale,
+        "database": args.database_url.split(":", 1)[0] if not args.base_url else None,
+        "base_url": base_url,
+        "concurrency": args.concurrency,
+        "duration_s": args.duration,
+        "workers": args.workers if server else None,
+        "python": platform.python_version(),
+        "routes": {},
+    }
+    try:
+        for route in routes:
+            if args.warmup:
+                drive(route, clients, args.warmup)
+            report["routes"][route] = drive(route, clients, args.duration)
+    finally:
+        for client in clients:
+            client.close()
+        if server:
+            server.terminate()
+            server.wait()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as handle:
+            handle.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# Measures /browse-products latency on its own and during a burst of logins.
+#
+#   cd app && python benchmarks/login_storm.py               # bounded hashing executor (current settings)
+#   cd app && python benchmarks/login_storm.py --unbounded   # hashing may take every worker thread at full priority
+#
+# Prints one JSON document: browse p99 in the "baseline" and "storm" phases, their ratio, and
+# whether the ratio stays within P99_BUDGET.
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+from common import APP_DIR, ensure_disposable, summarize, spawn_server
+
+# Storm browse p99 may be at most this many times the baseline p99
+P99_BUDGET = 2.0
+
+
+# Schema through the migrations, like a deployed database
+def seed(products):
+    import migrations
+    from database import Base, engine, SessionLocal
+    from models import User, Product
+    from hashing import pwd_context
+
+    Base.metadata.drop_all(bind=engine)
+    if engine.dialect.name == "sqlite":
+        # FTS5 shadow tables are outside the metadata
+        with engine.begin() as conn:
+            conn.exec_driver_sql("DROP TABLE IF EXISTS products_fts")
+    migrations.upgrade(engine)
+    with SessionLocal() as db:
+        password = pwd_context.hash("benchpass")
+        db.add(User(username="bench_customer", email="c@bench.local", role="customer", password=password))
+        db.add(User(username="bench_login", email="l@bench.local", role="customer", password=password))
+        db.add_all([
+            Product(category="Bench", subcategory=f"Item {i}", brand="Bench", desc=f"Benchmark product {i}", quantity=10, price=9.99)
+            for i in range(products)
+        ])
+        db.commit()
+
+
+def browse_loop(base_url, stop, samples):
+    import httpx
+
+    with httpx.Client(base_url=base_url, timeout=10) as client:
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                client.get("/browse-products", params={"user": "bench_customer"})
+            except httpx.HTTPError:
+                pass  # a timed-out page still counts, with its full wait
+            samples.append(time.perf_counter() - started)
+
+
+def login_loop(base_url, stop, outcomes):
+    import httpx
+
+    with httpx.Client(base_url=base_url, timeout=10) as client:
+        while not stop.is_set():
+            try:
+                response = client.post("/login", data={"username": "bench_login", "password": "benchpass"})
+            except httpx.HTTPError:
+                outcomes.append(None)
+                continue
+            outcomes.append(response.status_code)
+            # Shed logins ask the client to come back later; retrying immediately would turn the storm into a flood
+            if response.status_code == 503:
+                stop.wait(float(response.headers.get("Retry-After", 1)))
+
+
+def run_phase(base_url, browsers, storm, duration):
+    stop = threading.Event()
+    samples, outcomes = [], []
+    threads = [threading.Thread(target=browse_loop, args=(base_url, stop, samples)) for _ in range(browsers)]
+    threads += [threading.Thread(target=login_loop, args=(base_url, stop, outcomes)) for _ in range(storm)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    result = {"browse": summarize(samples)}
+    if storm:
+        result["logins"] = {
+            "attempts": len(outcomes),
+            "succeeded": sum(1 for code in outcomes if code in (200, 303)),
+            "shed_503": sum(1 for code in outcomes if code == 503),
+            "client_errors": sum(1 for code in outcomes if code is None),
+            "per_second": round(len(outcomes) / duration, 1),
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--database-url", default="sqlite:///./bench_login_storm.db")
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--browsers", type=int, default=4)
+    parser.add_argument("--storm", type=int, default=32, help="concurrent login clients")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unbounded", action="store_true", help="let hashing use every worker thread, for comparison")
+    parser.add_argument("--drop", action="store_true", help="allow dropping tables in a database not named as a bench/scratch one")
+    args = parser.parse_args()
+
+    ensure_disposable(args.database_url, args.drop)
+    env = {"DATABASE_URL": args.database_url}
+    if args.unbounded:
+        env.update(HASH_WORKERS="64", HASH_QUEUE="10000", HASH_NICE="0")
+    os.environ.update(env)
+    os.chdir(APP_DIR)
+    sys.path.insert(0, APP_DIR)
+
+    from config import settings
+
+    seed(args.products)
+    # The server runs in its own process, so the client threads do not compete with it for the GIL
+    server = spawn_server(args.port, env)
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        baseline = run_phase(base_url, args.browsers, 0, args.duration)
+        storm = run_phase(base_url, args.browsers, args.storm, args.duration)
+    finally:
+        server.terminate()
+        server.wait()
+    report = {
+        "cpus": os.cpu_count(),
+        "hash_workers": settings.HASH_WORKERS,
+        "hash_queue": settings.HASH_QUEUE,
+        "hash_nice": settings.HASH_NICE,
+        "bcrypt_rounds": settings.BCRYPT_ROUNDS,
+        "baseline": baseline,
+        "storm": storm,
+        # The goal: logins leave browse p99 within P99_BUDGET of the baseline
+        "browse_p99_ratio": round(storm["browse"]["p99_ms"] / baseline["browse"]["p99_ms"], 2),
+    }
+    report["meets_goal"] = report["browse_p99_ratio"] <= P99_BUDGET
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
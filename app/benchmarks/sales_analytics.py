@@ -0,0 +1,119 @@
+# Times the sales analytics paths over a generated order history.
+#
+#   cd app && python benchmarks/sales_analytics.py                  # 2M order items in SQLite
+#   cd app && python benchmarks/sales_analytics.py --items 5000000 --database-url mysql+pymysql://...
+#
+# Prints one JSON document: seconds per SQL GROUP BY summary, the one-off columnar load,
+# and the median of repeated pivots over the loaded cube (the interactive path).
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+from common import APP_DIR, ensure_disposable
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, round(time.perf_counter() - started, 4)
+
+
+def seed(items, products, customers, days, batch=50000):
+    from sqlalchemy import insert
+    from database import Base, engine
+    from models import User, Product, Order, OrderItem
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(7)
+    today = date.today()
+    prices = [round(rng.uniform(5, 500), 2) for _ in range(products)]
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {"id": i + 1, "username": f"customer{i}", "email": f"c{i}@bench.local", "role": "customer", "password": "x"}
+            for i in range(customers)
+        ])
+        conn.execute(insert(Product), [
+            {"id": i + 1, "category": f"Category {i % 12}", "subcategory": f"Item {i}", "brand": f"Brand {i % 40}",
+             "desc": "Benchmark product", "quantity": 1000, "price": prices[i]}
+            for i in range(products)
+        ])
+
+    # Three lines per order on average
+    order_id = item_id = 0
+    while item_id < items:
+        orders, lines = [], []
+        while item_id < items and len(lines) < batch:
+            order_id += 1
+            orders.append({"id": order_id, "user_id": rng.randint(1, customers), "status": "Delivered",
+                           "date": today - timedelta(days=rng.randrange(days))})
+            for _ in range(rng.randint(1, 5)):
+                item_id += 1
+                product = rng.randrange(products)
+                lines.append({"id": item_id, "order_id": order_id, "product_id": product + 1,
+                              "quantity": rng.randint(1, 4), "unit_price": prices[product]})
+        with engine.begin() as conn:
+            conn.execute(insert(Order), orders)
+            conn.execute(insert(OrderItem), lines)
+    return order_id, item_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--database-url", default="sqlite:///./bench_sales_analytics.db")
+    parser.add_argument("--items", type=int, default=2_000_000)
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--customers", type=int, default=20000)
+    parser.add_argument("--days", type=int, default=365, help="spread of order dates")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--skip-seed", action="store_true", help="reuse the data from a previous run")
+    parser.add_argument("--drop", action="store_true", help="allow dropping tables in a database not named as a bench/scratch one")
+    args = parser.parse_args()
+
+    if not args.skip_seed:
+        ensure_disposable(args.database_url, args.drop)
+    os.environ["DATABASE_URL"] = args.database_url
+    os.chdir(APP_DIR)
+    sys.path.insert(0, APP_DIR)
+
+    import analytics
+    from config import settings
+    from database import SessionLocal
+
+    report = {"items": args.items, "analytics_window_days": settings.ANALYTICS_WINDOW_DAYS}
+    if not args.skip_seed:
+        (orders, _), report["seed_seconds"] = timed(seed, args.items, args.products, args.customers, args.days)
+        report["orders"] = orders
+
+    today = date.today()
+    month_ago = today - timedelta(days=29)
+    with SessionLocal() as db:
+        report["sql_summary_seconds"] = {
+            dimension: timed(analytics.sales_summary, db, dimension, month_ago, today)[1]
+            for dimension in analytics.DIMENSIONS
+        }
+        cube, report["cube_load_seconds"] = timed(analytics.load_sales_cube, db, today)
+    report["cube_rows"] = len(cube)
+
+    pivots = {
+        "category_by_week_revenue": ("category", "week", "revenue"),
+        "brand_by_day_units": ("brand", "day", "units"),
+        "customer_orders": ("customer", None, "orders"),
+        "category_by_brand_revenue": ("category", "brand", "revenue"),
+    }
+    report["pivot_median_seconds"] = {
+        name: round(statistics.median(
+            timed(cube.pivot, rows, columns, measure, month_ago, today)[1] for _ in range(args.repeat)
+        ), 4)
+        for name, (rows, columns, measure) in pivots.items()
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
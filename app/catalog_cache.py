@@ -0,0 +1,90 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from jinja2.utils import url_quote
+from markupsafe import escape
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+from config import settings
+from models import CatalogVersion
+
+# Stands in for the username while a shared fragment is rendered; survives HTML
+# escaping unchanged and URL-encoding predictably, so both forms can be swapped back
+USER_PLACEHOLDER = "\ue000user\ue000"
+
+
+# Cached fragments and ETags embed the catalog version. It lives in one database row that is bumped
+# in the same transaction as every write to products, so all workers see a change as soon as it
+# commits (and a replica along with the rows it describes). Reading it is a primary-key lookup
+async def version(db):
+    return await db.scalar(select(CatalogVersion.version).where(CatalogVersion.id == 1))
+
+
+# Marks the session's transaction as changing the catalog; the version moves on commit
+def touch(db):
+    db.info["catalog_changed"] = True
+
+
+def bump(db):
+    db.execute(update(CatalogVersion).where(CatalogVersion.id == 1).values(version=CatalogVersion.version + 1))
+
+
+# Bumped last, so the version row's lock is held only for the commit itself
+@event.listens_for(Session, "before_commit")
+def _bump_on_commit(session):
+    if session.info.pop("catalog_changed", False):
+        bump(session)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session):
+    session.info.pop("catalog_changed", None)
+
+
+def etag(*parts):
+    digest = hashlib.sha1("\x1f".join(str(part) for part in parts).encode()).hexdigest()[:16]
+    return f'W/"{digest}"'
+
+
+# Rendered HTML fragments keyed by (catalog version, page parameters)
+class FragmentCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, html = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return html
+
+    def put(self, key, html):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, html)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+fragment_cache = FragmentCache(settings.CATALOG_CACHE_SIZE, settings.CATALOG_CACHE_TTL)
+
+
+# Puts the viewer's username back into a fragment rendered with USER_PLACEHOLDER
+def personalize(html, username):
+    return (
+        html.replace(url_quote(USER_PLACEHOLDER, for_qs=True), url_quote(username, for_qs=True))
+            .replace(USER_PLACEHOLDER, str(escape(username)))
+    )
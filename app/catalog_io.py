@@ -0,0 +1,202 @@
+import csv
+import io
+import json
+from datetime import date
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from models import Product, CartItem
+from reservations import held_stock
+
+BATCH_SIZE = 1000
+EXPORT_COLUMNS = ("id", "category", "subcategory", "brand", "desc", "quantity", "price", "date")
+REQUIRED_COLUMNS = ("category", "subcategory", "brand", "desc", "price")
+MAX_REPORTED_ERRORS = 20
+
+
+# ---- Export ----
+
+async def _export_batches(bind):
+    # Own session: the request's session is closed before the body finishes streaming
+    async with AsyncSession(bind=bind) as db:
+        # quantity goes out as stock on hand so that re-importing the file is a no-op
+        columns = [getattr(Product, name) for name in EXPORT_COLUMNS]
+        columns[EXPORT_COLUMNS.index("quantity")] = (Product.quantity + held_stock()).label("quantity")
+        result = await db.stream(select(*columns).order_by(Product.id).execution_options(yield_per=BATCH_SIZE))
+        async for batch in result.partitions():
+            yield batch
+
+
+async def export_csv(bind):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    async for batch in _export_batches(bind):
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+async def export_ndjson(bind):
+    async for batch in _export_batches(bind):
+        yield "".join(
+            json.dumps(dict(zip(EXPORT_COLUMNS, row)), default=str, ensure_ascii=False) + "\n"
+            for row in batch
+        )
+
+
+# ---- Import ----
+
+class ImportSummary:
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.skipped = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.skipped += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"Line {line}: {message}")
+
+
+def _read_records(stream, fmt):
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        for line, record in enumerate(csv.DictReader(text), start=2):
+            yield line, record
+    else:
+        for line, raw in enumerate(text, start=1):
+            raw = raw.strip()
+            if not raw:
+                continue
+            try:
+                record = json.loads(raw)
+            except ValueError:
+                yield line, None
+                continue
+            yield line, record if isinstance(record, dict) else None
+
+
+def _clean(record):
+    missing = [name for name in REQUIRED_COLUMNS if record.get(name) in (None, "")]
+    if missing:
+        raise ValueError("missing " + ", ".join(missing))
+    row = {
+        "category": str(record["category"]).strip(),
+        "subcategory": str(record["subcategory"]).strip(),
+        "brand": str(record["brand"]).strip(),
+        "desc": str(record["desc"]).strip(),
+        "price": float(record["price"]),
+        "quantity": int(record.get("quantity") or 0),
+        "date": date.fromisoformat(str(record["date"])) if record.get("date") else date.today(),
+    }
+    if record.get("id") not in (None, ""):
+        row["id"] = int(record["id"])
+    return row
+
+
+def _upsert(db: Session, rows):
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        stmt = mysql_insert(Product)
+        stmt = stmt.on_duplicate_key_update({name: stmt.inserted[name] for name in EXPORT_COLUMNS[1:]})
+    elif dialect == "sqlite":
+        stmt = sqlite_insert(Product)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Product.id],
+            set_={name: stmt.excluded[name] for name in EXPORT_COLUMNS[1:]},
+        )
+    else:
+        for row in rows:
+            db.merge(Product(**row))
+        return
+    db.execute(stmt, rows)
+
+
+# Stock on hand may not go below what carts hold; such rows are reported and left out
+def _drop_below_holds(db: Session, batch, summary):
+    keyed = {row["id"]: row["quantity"] for row in batch if "id" in row}
+    if not keyed:
+        return batch
+    held = dict(
+        db.query(CartItem.product_id, func.sum(CartItem.reserved))
+        .filter(CartItem.product_id.in_(list(keyed)), CartItem.reserved > 0)
+        .group_by(CartItem.product_id)
+    )
+    short = {product_id for product_id, units in held.items() if keyed[product_id] < units}
+    for product_id in sorted(short):
+        summary.skipped += 1
+        if len(summary.errors) < MAX_REPORTED_ERRORS:
+            summary.errors.append(f"Product {product_id}: quantity {keyed[product_id]} is below the {held[product_id]} units held in carts")
+    return [row for row in batch if row.get("id") not in short]
+
+
+def _flush(db: Session, batch, upsert, summary, last_line):
+    try:
+        if upsert:
+            batch = _drop_below_holds(db, batch, summary)
+        inserted, updated = _write_batch(db, batch, upsert)
+        db.commit()
+    except SQLAlchemyError as e:
+        # A bad batch is skipped as a whole; earlier batches stay committed
+        db.rollback()
+        summary.skipped += len(batch)
+        if len(summary.errors) < MAX_REPORTED_ERRORS:
+            summary.errors.append(f"Batch ending at line {last_line} rejected: {getattr(e, 'orig', e)}")
+        return
+    summary.inserted += inserted
+    summary.updated += updated
+
+
+def _write_batch(db: Session, batch, upsert):
+    new_rows = [row for row in batch if "id" not in row]
+    keyed_rows = [row for row in batch if "id" in row]
+    if new_rows:
+        db.execute(insert(Product), new_rows)
+    if not keyed_rows:
+        return len(new_rows), 0
+    if not upsert:
+        db.execute(insert(Product), keyed_rows)
+        return len(batch), 0
+    ids = {row["id"] for row in keyed_rows}
+    existing = {pid for (pid,) in db.query(Product.id).filter(Product.id.in_(ids))}
+    _upsert(db, keyed_rows)
+    if existing:
+        # Imported quantities are on hand; what carts already hold stays taken
+        db.execute(
+            update(Product)
+            .where(Product.id.in_(existing), held_stock() > 0)
+            .values(quantity=Product.quantity - held_stock())
+            .execution_options(synchronize_session=False)
+        )
+    return len(new_rows) + len(ids - existing), len(existing)
+
+
+# Streams records from an uploaded file and writes them in batches of BATCH_SIZE.
+# With upsert, rows carrying an id replace the existing product; otherwise ids must be new.
+def import_products(db: Session, stream, fmt="csv", upsert=False):
+    summary = ImportSummary()
+    batch = []
+    line = 0
+    for line, record in _read_records(stream, fmt):
+        if record is None:
+            summary.error(line, "not a JSON object")
+            continue
+        try:
+            batch.append(_clean(record))
+        except (ValueError, TypeError) as e:
+            summary.error(line, str(e))
+            continue
+        if len(batch) >= BATCH_SIZE:
+            _flush(db, batch, upsert, summary, line)
+            batch = []
+    if batch:
+        _flush(db, batch, upsert, summary, line)
+    return summary
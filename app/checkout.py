@@ -0,0 +1,124 @@
+import random
+import time
+from sqlalchemy import insert, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from models import Product, Order, OrderItem, CartItem
+from rollups import record_sales
+from pricing import cart_lines
+from inventory import refresh_low_stock
+import activity
+import catalog_cache
+
+MAX_RETRIES = 5
+# MySQL lock wait timeout / deadlock; SQLite reports contention as "database is locked"
+RETRYABLE_MYSQL_ERRORS = (1205, 1213)
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class OutOfStock(CheckoutError):
+    def __init__(self, products):
+        self.products = products
+        super().__init__("Not enough stock for: " + ", ".join(products))
+
+
+def is_retryable(exc):
+    orig = getattr(exc, "orig", None)
+    if orig is None:
+        return False
+    if orig.args and orig.args[0] in RETRYABLE_MYSQL_ERRORS:
+        return True
+    return "database is locked" in str(orig)
+
+
+def _place_order(db: Session, user_id: int):
+    # Lock the cart lines before reading them. Quantities and holds come from this one read, so a
+    # concurrent add-to-cart or sweep either committed before it or waits for the checkout to finish
+    locked = (
+        db.query(CartItem.id, CartItem.product_id, CartItem.quantity, CartItem.reserved)
+        .filter(CartItem.user_id == user_id)
+        .order_by(CartItem.id)
+        .with_for_update()
+        .all()
+    )
+    if not locked:
+        return None
+    cart_ids = [row.id for row in locked]
+    # Price and name per line; the quantities above are the ones that count
+    details = {line.id: line for line in cart_lines(db, CartItem.id.in_(cart_ids))}
+
+    # One line per product, in id order so concurrent checkouts lock rows consistently:
+    # [product_id, quantity, price, subcategory, quantity already held by the lines]
+    merged = {}
+    for row in locked:
+        detail = details[row.id]
+        line = merged.setdefault(row.product_id, [row.product_id, 0, detail.price, detail.subcategory, 0])
+        line[1] += row.quantity
+        line[4] += row.reserved
+    lines = [merged[product_id] for product_id in sorted(merged)]
+
+    # Claim the cart first; a concurrent checkout of the same cart finds nothing left to delete
+    deleted = db.query(CartItem).filter(CartItem.id.in_(cart_ids)).delete(synchronize_session=False)
+    if deleted != len(cart_ids):
+        raise CheckoutError("Cart changed during checkout, please try again")
+
+    # Only quantity without a hold is taken now, by conditional decrement: the row is only
+    # touched if enough stock is left. Fully reserved lines leave the product row alone
+    short, taken = [], []
+    for product_id, quantity, _, subcategory, held in lines:
+        missing = quantity - held
+        if missing <= 0:
+            continue
+        result = db.execute(
+            update(Product)
+            .where(Product.id == product_id, Product.quantity >= missing)
+            .values(quantity=Product.quantity - missing)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            short.append(subcategory)
+        taken.append(product_id)
+    if short:
+        raise OutOfStock(short)
+    if taken:
+        catalog_cache.touch(db)
+        refresh_low_stock(db, taken)
+
+    new_order = Order(
+        user_id=user_id,
+        item_count=sum(quantity for _, quantity, _, _, _ in lines),
+        total_amount=float(sum(price * quantity for _, quantity, price, _, _ in lines)),
+    )
+    db.add(new_order)
+    db.flush()
+
+    db.execute(insert(OrderItem), [
+        {"order_id": new_order.id, "product_id": product_id, "quantity": quantity, "unit_price": float(price)}
+        for product_id, quantity, price, _, _ in lines
+    ])
+
+    record_sales(db, new_order.date, [(product_id, quantity, float(price)) for product_id, quantity, price, _, _ in lines])
+    for product_id, quantity, _, subcategory, _ in lines:
+        activity.record(db, "sale", subject=subcategory, quantity=quantity, user_id=user_id, order_id=new_order.id)
+    return new_order.id
+
+
+# Turns the user's cart into an order in one transaction; returns the order id,
+# or None for an empty cart. Raises OutOfStock without changing anything.
+def place_order(db: Session, user_id: int):
+    for attempt in range(MAX_RETRIES):
+        try:
+            order_id = _place_order(db, user_id)
+            db.commit()
+            return order_id
+        except OperationalError as exc:
+            db.rollback()
+            if not is_retryable(exc) or attempt == MAX_RETRIES - 1:
+                raise
+            time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+        except Exception:
+            db.rollback()
+            raise
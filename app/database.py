@@ -1,10 +1,173 @@
-from sqlalchemy import create_engine
+import threading
+import time
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from config import settings
 
-engine = create_engine(settings.DATABASE_URL)
+ASYNC_DRIVERS = {"mysql": "mysql+aiomysql", "sqlite": "sqlite+aiosqlite"}
+SYNC_DRIVERS = {"mysql": "mysql+pymysql", "sqlite": "sqlite"}
+
+
+# Same database, async driver: mysql+pymysql -> mysql+aiomysql, sqlite -> sqlite+aiosqlite
+def async_url(url):
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+# The reverse, for threads that read through a sync session
+def sync_url(url):
+    url = make_url(url)
+    return url.set(drivername=SYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+# A replica holds the primary's data, so per-database caches treat it as the primary
+_aliases = {}
+
+
+# Identifies a database independently of the driver used to reach it
+def database_key(bind):
+    key = str(bind.url.set(drivername=bind.url.get_backend_name()))
+    return _aliases.get(key, key)
+
+
+# Checkout counts and time spent waiting for a free connection
+class PoolStats:
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, waited, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def snapshot(self, pool):
+        with self._lock:
+            return {
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_ms_total": round(self.wait_total * 1000, 3),
+                "wait_ms_max": round(self.wait_max * 1000, 3),
+            }
+
+
+class _TimedPool:
+    stats = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.stats.record(time.perf_counter() - started, timed_out=True)
+            raise
+        self.stats.record(time.perf_counter() - started)
+        return connection
+
+
+# Engine keyword arguments for a pooled connection to url, reporting into stats
+def pool_options(url, stats, is_async=False):
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}  # in-memory SQLite keeps its single shared connection
+    base = AsyncAdaptedQueuePool if is_async else QueuePool
+    # Class-level stats survive pool.recreate(), which instantiates self.__class__
+    poolclass = type(base.__name__, (_TimedPool, base), {"stats": stats})
+    return {
+        "poolclass": poolclass,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT}")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+# File-backed SQLite: WAL lets page reads run while a checkout writes, and writers
+# queue on the lock for SQLITE_BUSY_TIMEOUT instead of failing with "database is locked"
+def configure_sqlite(engine):
+    if engine.url.get_backend_name() == "sqlite" and engine.url.database not in (None, "", ":memory:"):
+        event.listen(engine, "connect", _sqlite_pragmas)
+    return engine
+
+
+pool_stats = {"sync": PoolStats(), "primary": PoolStats(), "replica": PoolStats(), "sync_replica": PoolStats()}
+
+# Sync engine: schema setup, background jobs and scripts
+engine = configure_sqlite(create_engine(settings.DATABASE_URL, **pool_options(settings.DATABASE_URL, pool_stats["sync"])))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engines: request handlers. Writes go to the primary, read-only pages to the replica
+_async_url = settings.ASYNC_DATABASE_URL or async_url(settings.DATABASE_URL)
+async_engine = create_async_engine(_async_url, **pool_options(_async_url, pool_stats["primary"], is_async=True))
+configure_sqlite(async_engine.sync_engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+if settings.REPLICA_DATABASE_URL or settings.ASYNC_REPLICA_DATABASE_URL:
+    _replica_url = settings.ASYNC_REPLICA_DATABASE_URL or async_url(settings.REPLICA_DATABASE_URL)
+    async_read_engine = create_async_engine(_replica_url, **pool_options(_replica_url, pool_stats["replica"], is_async=True))
+    configure_sqlite(async_read_engine.sync_engine)
+    _aliases[database_key(async_read_engine.sync_engine)] = database_key(async_engine.sync_engine)
+    # Sync replica engine: read-only work that runs in worker threads, such as the sales cube
+    _sync_replica_url = settings.REPLICA_DATABASE_URL or sync_url(settings.ASYNC_REPLICA_DATABASE_URL)
+    read_engine = configure_sqlite(create_engine(_sync_replica_url, **pool_options(_sync_replica_url, pool_stats["sync_replica"])))
+else:
+    async_read_engine = async_engine
+    read_engine = engine
+AsyncReadSessionLocal = async_sessionmaker(async_read_engine, autoflush=False, expire_on_commit=False)
+
+
+# session (route dependency)
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# Read-only pages: served from the replica when one is configured (may lag the primary slightly)
+async def get_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
+
+# Closes pooled connections on shutdown; engines reconnect lazily if used again
+async def dispose_engines():
+    if async_read_engine is not async_engine:
+        await async_read_engine.dispose()
+    await async_engine.dispose()
+    if read_engine is not engine:
+        read_engine.dispose()
+    engine.dispose()
+
+
+def pool_status():
+    engines = {"sync": engine, "primary": async_engine}
+    if async_read_engine is not async_engine:
+        engines["replica"] = async_read_engine
+    if read_engine is not engine:
+        engines["sync_replica"] = read_engine
+    return {name: pool_stats[name].snapshot(bind.pool) for name, bind in engines.items() if hasattr(bind.pool, "checkedout")}
+
 
-Base= declarative_base()
\ No newline at end of file
+Base= declarative_base()
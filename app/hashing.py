@@ -0,0 +1,82 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from passlib.context import CryptContext
+from config import settings
+
+# Hashes written with another cost are flagged by needs_update and upgraded on login
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto",
+    bcrypt__rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__max_rounds=settings.BCRYPT_ROUNDS,
+)
+
+
+class HashingOverloaded(Exception):
+    pass
+
+
+# Linux schedules threads individually: a niced hashing thread only gets the CPU time that
+# page requests leave idle, which matters most when there are fewer cores than hash workers
+def _lower_priority():
+    if settings.HASH_NICE and hasattr(os, "setpriority"):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), settings.HASH_NICE)
+        except OSError:
+            pass
+
+
+# bcrypt releases the GIL, so a small thread pool keeps hashing to HASH_WORKERS cores.
+# Admission is capped at workers + queue; anything beyond is refused immediately
+# instead of piling up behind the hashes and starving the request threadpool.
+class HashingExecutor:
+    def __init__(self, workers, queue, timeout):
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt", initializer=_lower_priority)
+        self._slots = threading.BoundedSemaphore(workers + queue)
+
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingOverloaded()
+        try:
+            future = self._pool.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def run(self, fn, *args):
+        future = self._submit(fn, *args)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise HashingOverloaded()
+
+    # For async routes: the event loop keeps serving other requests while the hash runs
+    async def run_async(self, fn, *args):
+        future = self._submit(fn, *args)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            raise HashingOverloaded()
+
+
+hashing_executor = HashingExecutor(settings.HASH_WORKERS, settings.HASH_QUEUE, settings.HASH_TIMEOUT)
+
+
+# passlib picks the bcrypt backend on the first hash; startup does it instead of the first login
+def load_hashing_backend():
+    pwd_context.handler().get_backend()
+
+
+async def hash_password(password):
+    return await hashing_executor.run_async(pwd_context.hash, password)
+
+
+# Returns (valid, new_hash); new_hash is set when the stored hash should be upgraded
+async def verify_password(password, hashed):
+    return await hashing_executor.run_async(pwd_context.verify_and_update, password, hashed)
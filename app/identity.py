@@ -0,0 +1,135 @@
+import base64
+import hashlib
+import hmac
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from sqlalchemy.orm import Session
+from config import settings
+from database import database_key
+from models import User
+
+SESSION_COOKIE = "session"
+
+# Raw session cookie of the request being served; set by middleware in main.py
+session_token = ContextVar("session_token", default=None)
+
+
+# The request names one user (?user=) while its valid session cookie belongs to another
+class SessionMismatch(Exception):
+    def __init__(self, username, session_username):
+        self.username = username
+        self.session_username = session_username
+        super().__init__(f"signed in as {session_username!r}, not {username!r}")
+
+
+def _b64encode(raw: bytes):
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _b64decode(value: str):
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+
+def _signature(payload: str):
+    if not settings.SECRET_KEY:
+        raise RuntimeError("SECRET_KEY is not set")
+    return _b64encode(hmac.new(settings.SECRET_KEY.encode(), payload.encode(), hashlib.sha256).digest())
+
+
+# Signed "payload.signature" token carrying the user's id, name and role
+def sign_session(user_id, username, role):
+    payload = _b64encode(json.dumps({"uid": user_id, "sub": username, "role": role, "iat": int(time.time())}).encode())
+    return f"{payload}.{_signature(payload)}"
+
+
+def read_session(token):
+    # An empty key would make every signature forgeable
+    if not token or "." not in token or not settings.SECRET_KEY:
+        return None
+    payload, signature = token.rsplit(".", 1)
+    if not hmac.compare_digest(signature, _signature(payload)):
+        return None
+    try:
+        data = json.loads(_b64decode(payload))
+    except ValueError:
+        return None
+    if time.time() - data.get("iat", 0) > settings.SESSION_MAX_AGE:
+        return None
+    if identity_cache.revoked_after(data["sub"], data["iat"]):
+        return None
+    return {"id": data["uid"], "username": data["sub"], "role": data["role"]}
+
+
+# Username -> identity, bounded in size and age; one per database
+class IdentityCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._revoked = OrderedDict()   # username -> revocation time, oldest first
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, identity = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return identity
+
+    def put(self, key, identity):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, identity)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    # Call when a user is created, renamed or changes role
+    def invalidate(self, username):
+        with self._lock:
+            for key in [key for key in self._entries if key[1] == username]:
+                del self._entries[key]
+            now = time.time()
+            self._revoked.pop(username, None)
+            self._revoked[username] = now
+            # Every token issued before an older revocation has expired anyway
+            while next(iter(self._revoked.values())) < now - settings.SESSION_MAX_AGE:
+                self._revoked.popitem(last=False)
+
+    def revoked_after(self, username, issued_at):
+        revoked = self._revoked.get(username)
+        return revoked is not None and issued_at < int(revoked)
+
+
+identity_cache = IdentityCache(settings.IDENTITY_CACHE_SIZE, settings.IDENTITY_CACHE_TTL)
+
+
+# A valid session cookie decides who the request is from: it needs no lookup, and a ?user=
+# naming someone else raises SessionMismatch. Without one, the named user is looked up.
+def resolve_identity(username: str, db: Session):
+    identity = read_session(session_token.get())
+    if identity:
+        if identity["username"] != username:
+            raise SessionMismatch(username, identity["username"])
+        return identity
+
+    key = (database_key(db.get_bind()), username)
+    identity = identity_cache.get(key)
+    if identity is None:
+        row = db.query(User.id, User.username, User.role).filter(User.username == username).first()
+        if row is None:
+            return None
+        identity = {"id": row.id, "username": row.username, "role": row.role}
+        identity_cache.put(key, identity)
+    return identity
@@ -0,0 +1,250 @@
+import csv
+import io
+import math
+from datetime import date, timedelta
+from sqlalchemy import bindparam, case, delete, exists, func, insert, select, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from config import settings
+from models import Product, Order, OrderItem, CartItem, LowStock, DailySales
+import activity
+
+# Keeps each CASE statement well under driver bind-parameter limits
+RESTOCK_CHUNK = 500
+PURGE_CHUNK = 500
+LOW_STOCK_CHUNK = 500
+# Above this many newly low products, one summary alert replaces the per-product ones
+MAX_LOW_STOCK_ALERTS = 10
+
+
+class ProductInUse(Exception):
+    pass
+
+
+class RestockSummary:
+    def __init__(self):
+        self.updated = []     # (product_id, subcategory, added, new quantity)
+        self.missing = []     # product ids that do not exist
+        self.errors = []      # unparseable input lines
+
+    @property
+    def units(self):
+        return sum(added for _, _, added, _ in self.updated)
+
+
+# Accepts "product_id,added_quantity" lines (CSV, optional header); returns ({id: qty}, errors)
+def parse_restock_lines(lines):
+    increments, errors = {}, []
+    for line_no, row in enumerate(csv.reader(lines), start=1):
+        if not row or not "".join(row).strip():
+            continue
+        if len(row) < 2:
+            errors.append(f"Line {line_no}: expected product_id,added_quantity")
+            continue
+        try:
+            product_id, added = int(row[0]), int(row[1])
+        except ValueError:
+            if line_no != 1:  # tolerate a header row
+                errors.append(f"Line {line_no}: not a number")
+            continue
+        if added <= 0:
+            errors.append(f"Line {line_no}: quantity must be positive")
+            continue
+        increments[product_id] = increments.get(product_id, 0) + added
+    return increments, errors
+
+
+def parse_restock_upload(stream):
+    return parse_restock_lines(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+
+
+# Applies every increment in one transaction with one UPDATE ... CASE per chunk
+def restock_products(db: Session, increments):
+    summary = RestockSummary()
+    ids = sorted(increments)
+    for start in range(0, len(ids), RESTOCK_CHUNK):
+        chunk = ids[start:start + RESTOCK_CHUNK]
+        db.execute(
+            update(Product)
+            .where(Product.id.in_(chunk))
+            .values(quantity=Product.quantity + case({pid: increments[pid] for pid in chunk}, value=Product.id))
+            .execution_options(synchronize_session=False)
+        )
+
+    found = set()
+    for start in range(0, len(ids), RESTOCK_CHUNK):
+        chunk = ids[start:start + RESTOCK_CHUNK]
+        for product_id, subcategory, quantity in (
+            db.query(Product.id, Product.subcategory, Product.quantity).filter(Product.id.in_(chunk))
+        ):
+            found.add(product_id)
+            summary.updated.append((product_id, subcategory, increments[product_id], quantity))
+    summary.updated.sort()
+    summary.missing = [pid for pid in ids if pid not in found]
+    refresh_low_stock(db, sorted(found))
+    return summary
+
+
+# Deletes a product whose orders are all delivered, using set-based statements.
+# Returns the ids of orders that lost an item (candidates for purge_empty_orders),
+# or None if the product does not exist. Raises ProductInUse; the caller commits.
+def delete_product_records(db: Session, product_id: int):
+    if db.query(Product.id).filter(Product.id == product_id).first() is None:
+        return None
+
+    in_progress = db.query(exists().where(
+        OrderItem.product_id == product_id,
+        OrderItem.order_id == Order.id,
+        Order.status != "Delivered",
+    )).scalar()
+    if in_progress:
+        raise ProductInUse(product_id)
+
+    order_ids = [oid for (oid,) in db.query(OrderItem.order_id).filter(OrderItem.product_id == product_id).distinct()]
+    db.execute(delete(OrderItem).where(OrderItem.product_id == product_id))
+    db.execute(delete(CartItem).where(CartItem.product_id == product_id))
+    db.execute(delete(LowStock).where(LowStock.product_id == product_id))
+    db.execute(delete(Product).where(Product.id == product_id))
+    return order_ids
+
+
+# Background cleanup: drop the given orders if they no longer have any items
+async def purge_empty_orders(bind, order_ids):
+    async with AsyncSession(bind=bind) as db:
+        for start in range(0, len(order_ids), PURGE_CHUNK):
+            chunk = order_ids[start:start + PURGE_CHUNK]
+            await db.execute(
+                delete(Order)
+                .where(Order.id.in_(chunk), ~exists(select(OrderItem.id).where(OrderItem.order_id == Order.id)))
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+
+
+# ---- Low stock ----
+
+def _reorder_level():
+    return func.coalesce(Product.reorder_level, settings.LOW_STOCK_THRESHOLD)
+
+
+# Rebuilds the whole table; for migrations and bulk imports, never the checkout path
+def _sync_all_low_stock(db):
+    before = set(db.execute(select(LowStock.product_id)).scalars())
+    db.execute(delete(LowStock))
+    level = _reorder_level()
+    db.execute(insert(LowStock).from_select(
+        ["product_id", "quantity", "reorder_level"],
+        select(Product.id, Product.quantity, level).where(Product.quantity < level),
+    ))
+    return [product_id for product_id in db.execute(select(LowStock.product_id)).scalars() if product_id not in before]
+
+
+def _upsert_low_stock(db, rows):
+    table = LowStock.__table__
+    dialect = db.dialect.name if hasattr(db, "dialect") else db.get_bind().dialect.name
+    if dialect == "mysql":
+        stmt = mysql_insert(table)
+        stmt = stmt.on_duplicate_key_update(quantity=stmt.inserted.quantity, reorder_level=stmt.inserted.reorder_level)
+    elif dialect == "sqlite":
+        stmt = sqlite_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.product_id],
+            set_={"quantity": stmt.excluded.quantity, "reorder_level": stmt.excluded.reorder_level},
+        )
+    else:
+        for row in rows:
+            db.execute(delete(table).where(table.c.product_id == row["product_id"]))
+            db.execute(insert(table).values(**row))
+        return
+    db.execute(stmt, rows)
+
+
+# Re-evaluates the given products (all when None) against their reorder level.
+# Works on a Session or a Connection; returns newly low product ids.
+# This runs inside checkout and reservation transactions, so it writes only low_stock rows keyed by the
+# touched ids: an upsert for each low product, a delete for each listed one that recovered. Rows the read
+# did not see are never deleted, so no gap locks are taken; readers re-check against the products table
+def sync_low_stock(db, product_ids=None):
+    if product_ids is None:
+        return _sync_all_low_stock(db)
+    ids = sorted(set(product_ids))
+    flagged = []
+    level = _reorder_level()
+    for start in range(0, len(ids), LOW_STOCK_CHUNK):
+        chunk = ids[start:start + LOW_STOCK_CHUNK]
+        listed = set(db.execute(select(LowStock.product_id).where(LowStock.product_id.in_(chunk))).scalars())
+        low, recovered = [], []
+        for product_id, quantity, reorder_level in db.execute(
+            select(Product.id, Product.quantity, level).where(Product.id.in_(chunk))
+        ):
+            if quantity < reorder_level:
+                low.append({"product_id": product_id, "quantity": quantity, "reorder_level": reorder_level})
+            elif product_id in listed:
+                recovered.append({"recovered_id": product_id})
+        if low:
+            _upsert_low_stock(db, low)
+        if recovered:
+            table = LowStock.__table__
+            db.execute(delete(table).where(table.c.product_id == bindparam("recovered_id")), recovered)
+        flagged += [row["product_id"] for row in low if row["product_id"] not in listed]
+    return flagged
+
+
+# Call after changing product quantities or reorder levels; alerts land in the activity feed
+def refresh_low_stock(db: Session, product_ids=None):
+    flagged = sync_low_stock(db, product_ids)
+    if len(flagged) > MAX_LOW_STOCK_ALERTS:
+        activity.record(db, "low_stock", subject=f"{len(flagged)} products")
+    elif flagged:
+        for subcategory, quantity in db.query(Product.subcategory, Product.quantity).filter(Product.id.in_(flagged)):
+            activity.record(db, "low_stock", subject=subcategory, quantity=quantity)
+    return flagged
+
+
+class LowStockRow:
+    __slots__ = ("product_id", "category", "subcategory", "brand", "quantity", "reorder_level", "sold", "suggested")
+
+    def __init__(self, product_id, category, subcategory, brand, quantity, reorder_level):
+        self.product_id = product_id
+        self.category = category
+        self.subcategory = subcategory
+        self.brand = brand
+        self.quantity = quantity
+        self.reorder_level = reorder_level
+        self.sold = 0
+        self.suggested = 0
+
+
+# low_stock lists candidates; the product's own figures decide (see sync_low_stock)
+def still_low():
+    return Product.quantity < _reorder_level()
+
+
+# Low-stock products, furthest below their level first, with a suggested restock quantity:
+# enough for RESTOCK_COVER_DAYS of recent sales, and at least twice the reorder level
+def low_stock_report(db: Session, today=None):
+    level = _reorder_level()
+    rows = [
+        LowStockRow(*row) for row in
+        db.query(LowStock.product_id, Product.category, Product.subcategory, Product.brand, Product.quantity, level)
+        .join(Product, Product.id == LowStock.product_id)
+        .filter(still_low())
+        .order_by(Product.quantity - level, LowStock.product_id)
+    ]
+    if not rows:
+        return rows
+
+    since = (today or date.today()) - timedelta(days=settings.RESTOCK_LOOKBACK_DAYS)
+    sold = dict(
+        db.query(DailySales.product_id, func.sum(DailySales.units))
+        .filter(DailySales.product_id.in_([row.product_id for row in rows]), DailySales.day >= since)
+        .group_by(DailySales.product_id)
+    )
+    for row in rows:
+        row.sold = int(sold.get(row.product_id) or 0)
+        daily = row.sold / settings.RESTOCK_LOOKBACK_DAYS
+        target = max(2 * row.reorder_level, math.ceil(daily * settings.RESTOCK_COVER_DAYS))
+        row.suggested = max(target - row.quantity, 1)
+    return rows
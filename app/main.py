@@ -1,84 +1,213 @@
-from fastapi import FastAPI, Request, Form, Depends, Query
-from fastapi.responses import RedirectResponse, HTMLResponse, StreamingResponse
+from fastapi import APIRouter, FastAPI, Request, Form, Depends, Query, UploadFile, File, BackgroundTasks
+from fastapi.responses import RedirectResponse, HTMLResponse, StreamingResponse, JSONResponse, Response
 from fastapi.templating import Jinja2Templates
-from sqlalchemy import func, desc, or_, cast, String
-from sqlalchemy.orm import Session
-from database import Base, engine, SessionLocal
+from sqlalchemy import func, select, text, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import (Base, engine, read_engine, SessionLocal, AsyncSessionLocal, AsyncReadSessionLocal, pool_status, database_key,
+                      dispose_engines, get_db, get_read_db)
 from models import User, Product, Order, OrderItem, CartItem
 import models
+from pagination import paginate_products, parse_date, PAGE_SIZE, SORT_LABELS, DEFAULT_SORT
+from search import create_search_backend, SearchFilters
+from queries import (delivered_orders, open_orders, user_orders, todays_sales_total, low_stock_count,
+                     customer_purchase_totals, customer_todays_purchases)
+from rollups import backfill_if_empty
+from checkout import place_order, CheckoutError, OutOfStock
+from reservations import reserve, remove_cart_line, held_stock, run_sweeper
+from pricing import price_cart
+from catalog_io import export_csv, export_ndjson, import_products
+from inventory import (restock_products, parse_restock_lines, parse_restock_upload, ProductInUse,
+                       purge_empty_orders, delete_product_records, refresh_low_stock, low_stock_report)
+import activity
+import analytics
+import api
+import order_status
+import catalog_cache
+import migrations
+import metrics
+from identity import SESSION_COOKIE, SessionMismatch, session_token, sign_session, identity_cache, resolve_identity
+from hashing import hash_password, verify_password, load_hashing_backend, HashingOverloaded
+from config import settings
 from fastapi.staticfiles import StaticFiles
-from passlib.context import CryptContext
-from datetime import date
+from datetime import date, timedelta
+from contextlib import asynccontextmanager
+from typing import Annotated, List, Union
+from pydantic import BeforeValidator
+import asyncio
+import json
+import time
 
-# Binding with database
-Base.metadata.create_all(bind=engine)
-
-app = FastAPI()
+router = APIRouter()
 
 # Connects Templates
 templates = Jinja2Templates(directory="templates")
 
+# Product search index (FULLTEXT / FTS5 / in-memory); chosen on first use, the FTS5 probe needs a connection
+_search_backend = None
+
+
+def search_backend():
+    global _search_backend
+    if _search_backend is None:
+        _search_backend = create_search_backend(engine, settings.SEARCH_BACKEND)
+    return _search_backend
+
+
+# Compiles every template up front, so the first request to each page does not pay for it
+def precompile_templates():
+    for name in templates.env.list_templates(extensions=["html"]):
+        templates.env.get_template(name)
+
+
+# Blocking startup work: schema migrations, rollup backfill, search backend, bcrypt backend
+def initialize():
+    if not settings.SECRET_KEY:
+        raise RuntimeError("SECRET_KEY must be set; every worker signs and checks session cookies with it")
+    if settings.RUN_MIGRATIONS:
+        migrations.upgrade(engine)
+        with SessionLocal() as db:
+            backfill_if_empty(db)
+    search_backend()
+    load_hashing_backend()
+    if settings.PRECOMPILE_TEMPLATES:
+        precompile_templates()
+
+
+# Nothing touches the database at import, so tests and tooling can import main without one.
+# Workers run initialize() here, off the event loop; /readyz answers 503 until it has finished
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.ready = False
+    started = time.perf_counter()
+    await asyncio.to_thread(initialize)
+    app.state.startup_seconds = round(time.perf_counter() - started, 3)
+    app.state.ready = True
+    sweeper = None
+    if settings.RESERVATION_SWEEP_INTERVAL > 0:
+        sweeper = asyncio.create_task(run_sweeper(SessionLocal, settings.RESERVATION_SWEEP_INTERVAL))
+    try:
+        yield
+    finally:
+        app.state.ready = False
+        if sweeper:
+            sweeper.cancel()
+        await dispose_engines()
+
+# Makes the signed session cookie visible to get_user_context
+async def load_session(request: Request, call_next):
+    token = session_token.set(request.cookies.get(SESSION_COOKIE))
+    try:
+        return await call_next(request)
+    finally:
+        session_token.reset(token)
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-# Mount the static files directory
-app.mount("/static", StaticFiles(directory="static"), name="static")
-
-# session 
-def get_db():
-    db = SessionLocal()
+# Latency and SQL work per route template, served from /metrics
+async def record_metrics(request: Request, call_next):
+    stats = metrics.RequestStats()
+    token = metrics.current_request.set(stats)
+    started = time.perf_counter()
     try:
-        yield db
+        response = await call_next(request)
     finally:
-        db.close()
+        metrics.current_request.reset(token)
+    route = request.scope.get("route")
+    metrics.registry.observe(request.method, getattr(route, "path", "unmatched"), response.status_code,
+                             time.perf_counter() - started, stats)
+    return response
+
+# Returns {"id", "username", "role"} from the session cookie or the identity cache
+async def get_user_context(username: str, db: AsyncSession):
+    return await db.run_sync(lambda session: resolve_identity(username, session))
+
+
+# Liveness: the process is up and serving; never touches the database
+@router.get("/healthz")
+async def healthz():
+    return JSONResponse({"status": "ok"})
+
+# Readiness: startup has finished and the primary database answers
+@router.get("/readyz")
+async def readyz(request: Request, db: AsyncSession = Depends(get_db)):
+    if not getattr(request.app.state, "ready", False):
+        return JSONResponse({"status": "starting"}, status_code=503)
+    try:
+        await asyncio.wait_for(db.execute(text("SELECT 1")), settings.READINESS_TIMEOUT)
+    except (SQLAlchemyError, OSError, asyncio.TimeoutError):
+        return JSONResponse({"status": "database unavailable"}, status_code=503)
+    return JSONResponse({"status": "ready", "startup_seconds": request.app.state.startup_seconds})
 
-def get_user_context(username: str, db: Session):
-    user_obj = db.query(User).filter(User.username == username).first()
-    return {"username": user_obj.username, "role": user_obj.role}
+# Prometheus text format
+@router.get("/metrics")
+def prometheus_metrics():
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
 
+# Connection pool usage per engine: checkouts, waits and timeouts
+@router.get("/pool-stats")
+def pool_stats():
+    return JSONResponse(pool_status())
 
 # main route
-@app.get("/", response_class=HTMLResponse)
-def read_root(request: Request):
+@router.get("/", response_class=HTMLResponse)
+async def read_root(request: Request):
     return templates.TemplateResponse(request, "login.html", {})
 
 # login route
-@app.get("/login", response_class=HTMLResponse)
-def login_page(request: Request):
+@router.get("/login", response_class=HTMLResponse)
+async def login_page(request: Request):
     return templates.TemplateResponse(request, "login.html", {})
 
-@app.post("/login", response_class=HTMLResponse)
-def login(request: Request, username: str = Form(...), password: str = Form(...)):
-    db: Session = SessionLocal()
-    user = db.query(User).filter(User.username == username).first()
+@router.post("/login", response_class=HTMLResponse)
+async def login(request: Request, username: str = Form(...), password: str = Form(...), db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(User).where(User.username == username))
 
     if user is None:
         return templates.TemplateResponse(request, "login.html", {"error": "Username does not exist"})
 
-    if not pwd_context.verify(password, user.password):
+    try:
+        valid, new_hash = await verify_password(password, user.password)
+    except HashingOverloaded:
+        return templates.TemplateResponse(request, "login.html", {"error": "Too many sign-in attempts, please try again shortly"},
+                                          status_code=503, headers={"Retry-After": "1"})
+
+    if not valid:
         return templates.TemplateResponse(request,"login.html", {"error": "Incorrect password"})
 
-    return RedirectResponse(url=f"/dashboard?user={user.username}", status_code=303)
+    # Stored hash uses an old bcrypt cost; upgrade it transparently
+    if new_hash:
+        user.password = new_hash
+        await db.commit()
+
+    response = RedirectResponse(url=f"/dashboard?user={user.username}", status_code=303)
+    response.set_cookie(SESSION_COOKIE, sign_session(user.id, user.username, user.role),
+                        max_age=settings.SESSION_MAX_AGE, httponly=True, samesite="lax")
+    return response
 
 # logout route
-@app.post("/logout", name="logout")
-def logout(request: Request):
-    return RedirectResponse(url="/", status_code=302)
+@router.post("/logout", name="logout")
+async def logout(request: Request):
+    response = RedirectResponse(url="/", status_code=302)
+    response.delete_cookie(SESSION_COOKIE)
+    return response
 
 # registration route
-@app.get("/register", response_class=HTMLResponse)
-def register_page(request: Request):
+@router.get("/register", response_class=HTMLResponse)
+async def register_page(request: Request):
     return templates.TemplateResponse(request, "register.html", {})
 
-@app.post("/register", response_class=HTMLResponse)
-def register(request: Request, username: str = Form(...), email: str = Form(...), role: str = Form(...), password: str = Form(...), confirm_password: str = Form(...)):
+@router.post("/register", response_class=HTMLResponse)
+async def register(request: Request, username: str = Form(...), email: str = Form(...), role: str = Form(...), password: str = Form(...), confirm_password: str = Form(...),
+                   db: AsyncSession = Depends(get_db)):
 
     if password != confirm_password:
         return templates.TemplateResponse(request, "register.html", {"error": "Passwords do not match"})
     
-    hashed_password = pwd_context.hash(password)
-    db: Session = SessionLocal()
-    existing_user = db.query(User).filter((User.username == username) | (User.email == email)).first()
+    try:
+        hashed_password = await hash_password(password)
+    except HashingOverloaded:
+        return templates.TemplateResponse(request, "register.html", {"error": "Server is busy, please try again shortly"},
+                                          status_code=503, headers={"Retry-After": "1"})
+    existing_user = await db.scalar(select(User).where((User.username == username) | (User.email == email)))
 
     if existing_user:
         return templates.TemplateResponse(request, "register.html", {"error": "User or email already exists"})
@@ -86,64 +215,44 @@ def register(request: Request, username: str = Form(...), email: str = Form(...)
     try:
         new_user = User(username=username, email=email, role=role, password=hashed_password)
         db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
+        await db.commit()
+        identity_cache.invalidate(username)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return templates.TemplateResponse(request, "register.html", {"error": str(e)})
-    finally:
-        db.close()
 
     return RedirectResponse(url="/login", status_code=303)
 
 # Dashboard route -> role based access
-@app.get("/dashboard", response_class=HTMLResponse)
-def dashboard(request: Request, user: str, db: Session = Depends(get_db)):
-    context = get_user_context(user, db)
+@router.get("/dashboard", response_class=HTMLResponse)
+async def dashboard(request: Request, user: str, db: AsyncSession = Depends(get_read_db)):
+    context = await get_user_context(user, db)
     
     # Return if Admin login
     if context["role"] == "admin":
-        total_products = db.query(func.count(Product.id)).scalar()
+        total_products = await db.scalar(select(func.count(Product.id)))
         today = date.today()
-        today_orders = db.query(OrderItem).join(Order).filter(Order.date == today).all()
-        todays_sales = sum(item.quantity * item.product.price for item in today_orders)
-        low_stock_items = db.query(Product).filter(Product.quantity < 5).all()
-
-        recent_activities = []
-        latest_orders = db.query(Order).order_by(desc(Order.date)).limit(5).all()
-        for order in latest_orders:
-            for item in order.items:
-                recent_activities.append(f"Sold {item.quantity} units of {item.product.subcategory} on {order.date.strftime('%d %B %Y')}")
-        recent_products = db.query(Product).order_by(desc(Product.date)).limit(5).all()
-        for product in recent_products:
-            recent_activities.append(f"Added new product: {product.subcategory}")
+        todays_sales = await db.run_sync(todays_sales_total, today)
+
+        recent_activities = [activity.describe(entry) for entry in await db.run_sync(activity.recent)]
 
         return templates.TemplateResponse(request,"dashboard.html", {
             "username": context["username"],
             "role": context["role"],
             "total_products": total_products,
             "todays_sales": todays_sales,
-            "low_stock_count": len(low_stock_items),
-            "recent_activities": recent_activities[:5]
+            "low_stock_count": await db.run_sync(low_stock_count),
+            "recent_activities": recent_activities
         })
     
     # Returns if Customer Login
     elif context["role"] == "customer":
-        user_obj = db.query(User).filter(User.username == user).first()
         today = date.today()
-        today_orders = db.query(OrderItem).join(Order).filter(Order.user_id == user_obj.id, Order.date == today).all()
-        todays_total = sum(item.quantity * item.product.price for item in today_orders)
-        todays_products = [item.product.subcategory for item in today_orders]
-
-        all_orders = db.query(OrderItem).join(Order).filter(Order.user_id == user_obj.id).all()
-        total_quantity = sum(item.quantity for item in all_orders)
-        total_products = len({item.product_id for item in all_orders})
+        todays_total, todays_products = await db.run_sync(customer_todays_purchases, context["id"], today)
+        total_quantity, total_products = await db.run_sync(customer_purchase_totals, context["id"])
 
-        recent_purchases = []
-        latest_orders = db.query(Order).filter(Order.user_id == user_obj.id).order_by(desc(Order.date)).limit(5).all()
-        for order in latest_orders:
-            for item in order.items:
-                recent_purchases.append(f"You purchased {item.quantity} x {item.product.subcategory} on {order.date.strftime('%d %B %Y')} (Status: {order.status})")
+        recent_purchases = [activity.describe_for_customer(entry)
+                            for entry in await db.run_sync(activity.recent_for_user, context["id"])]
 
         return templates.TemplateResponse(request, "dashboard.html", {
             "username": context["username"],
@@ -156,45 +265,58 @@ def dashboard(request: Request, user: str, db: Session = Depends(get_db)):
         })
 
 # View products route -> role based access
-@app.get("/view-products")
-def view_products(request: Request, search: str = "", user: str = Query(...), message: str = "", db: Session = Depends(get_db)):
-    context = get_user_context(user, db)
-
-    if search:
-        search_pattern = f"%{search}%"
-        products = db.query(Product).filter(
-            or_(
-                cast(Product.id, String).ilike(search_pattern),
-                Product.category.ilike(search_pattern),
-                Product.subcategory.ilike(search_pattern),
-                Product.brand.ilike(search_pattern),
-                Product.desc.ilike(search_pattern),
-                cast(Product.price, String).ilike(search_pattern),
-                cast(Product.quantity, String).ilike(search_pattern),
-                cast(Product.date, String).ilike(search_pattern)
-            )
-        ).all()
-    else:
-        products = db.query(Product).all()
+@router.get("/view-products")
+async def view_products(request: Request, search: str = "", user: str = Query(...), message: str = "",
+                  sort: str = "", after: str = "", before: str = "", limit: int = PAGE_SIZE,
+                  min_price: str = "", max_price: str = "", category: str = "", in_stock: str = "",
+                  db: AsyncSession = Depends(get_read_db)):
+    context = await get_user_context(user, db)
+
+    filters = SearchFilters.from_params(min_price, max_price, category, in_stock)
+    sort_options = {"relevance": "Relevance", **SORT_LABELS} if search else SORT_LABELS
+
+    # Search backends and paging work on ORM queries; run_sync drives them over the async connection.
+    # Both only read (migrations build the search index on the primary), so they are safe on the replica
+    def load_page(session):
+        query = filters.apply(session.query(Product))
+        if not search:
+            return paginate_products(query, sort=sort or DEFAULT_SORT, after=after, before=before, limit=limit)
+        if sort in ("", "relevance"):
+            return search_backend().ranked_page(session, query, search, after=after, before=before, limit=limit)
+        query, _ = search_backend().matching(session, query, search)
+        return paginate_products(query, sort=sort, after=after, before=before, limit=limit)
+
+    page = await db.run_sync(load_page)
 
     return templates.TemplateResponse("view_products.html", {
         "request": request,
-        "products": products,
+        "products": page,
+        "page": page,
+        "page_path": "/view-products",
+        "sort_options": sort_options,
+        "filters": filters,
+        "filter_params": filters.params(),
         "search": search,
         "username": context["username"],
         "role": context["role"],
         "message": message
     })
 
+# Optional non-negative whole-number form field: browsers send "" for an empty input, which means "not set"
+OptionalIntForm = Annotated[Union[int, None], Form(ge=0), BeforeValidator(lambda value: None if value == "" else value)]
+
 # Edit product -> Role: Admin 
-@app.get("/edit-product/{product_id}")
-def edit_product_form(product_id: int, request: Request, user: str = Query(...), db: Session = Depends(get_db)):
-    context = get_user_context(user, db)
-    product = db.query(models.Product).filter(models.Product.id == product_id).first()
-    return templates.TemplateResponse(request, "edit_product.html", {"product": product, "username": context["username"], "role": context["role"]})
-
-@app.post("/edit-product/{product_id}")
-def update_product(
+@router.get("/edit-product/{product_id}")
+async def edit_product_form(product_id: int, request: Request, user: str = Query(...), db: AsyncSession = Depends(get_db)):
+    context = await get_user_context(user, db)
+    product = await db.get(models.Product, product_id)
+    # The form edits stock on hand: what is left to sell plus what carts hold
+    held = await db.scalar(select(held_stock()).where(models.Product.id == product_id))
+    return templates.TemplateResponse(request, "edit_product.html", {"product": product, "held": held or 0,
+                                                                     "username": context["username"], "role": context["role"]})
+
+@router.post("/edit-product/{product_id}")
+async def update_product(
     product_id: int,
     user: str = Query(...),  # ✅ Fix: Get user from query param
     category: str = Form(...),
@@ -203,68 +325,76 @@ def update_product(
     desc: str = Form(...),
     quantity: int = Form(...),
     price: float = Form(...),
-    db: Session = Depends(get_db)
+    reorder_level: OptionalIntForm = None,  # blank uses the default threshold
+    db: AsyncSession = Depends(get_db)
 ):
-    product = db.query(models.Product).filter(models.Product.id == product_id).first()
+    product = await db.get(models.Product, product_id)
     product.category = category
     product.subcategory = subcategory
     product.brand = brand
     product.desc = desc
-    product.quantity = quantity
     product.price = price
-    db.commit()
+    product.reorder_level = reorder_level
+    await db.flush()
+    # quantity is on hand; holds already in carts stay taken, so it may not go below them
+    result = await db.execute(
+        update(models.Product)
+        .where(models.Product.id == product_id, held_stock() <= quantity)
+        .values(quantity=quantity - held_stock())
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        await db.rollback()
+        held = await db.scalar(select(held_stock()).where(models.Product.id == product_id))
+        return RedirectResponse(
+            f"/view-products?user={user}&message=Cannot+set+stock+below+the+{held or 0}+units+held+in+carts.",
+            status_code=303,
+        )
+    await db.run_sync(refresh_low_stock, [product_id])
+    catalog_cache.touch(db)
+    await db.commit()
+    await db.run_sync(search_backend().index_product, product)
     return RedirectResponse(f"/view-products?user={user}", status_code=303)
 
 # Delete Product -> Role: Admin
-@app.post("/delete-product/{product_id}")
-def delete_product(
+@router.post("/delete-product/{product_id}")
+async def delete_product(
     request: Request,   
     product_id: int,
+    background_tasks: BackgroundTasks,
     user: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    product = db.query(Product).filter(Product.id == product_id ).first()
-    if not product:
-        return templates.TemplateResponse(request, "message.html", {
-            "message": "Product not found."
-        })
-
-    # Get all related order items
-    order_items = db.query(OrderItem).filter(OrderItem.product_id == product_id).all()
-
-    # Check if any order linked to this product is not delivered
-    for item in order_items:
-        order = db.query(Order).filter(Order.id == item.order_id).first()
-        if order and order.status != "Delivered":
-            return RedirectResponse(
+    try:
+        order_ids = await db.run_sync(delete_product_records, product_id)
+    except ProductInUse:
+        await db.rollback()
+        return RedirectResponse(
             f"/view-products?user={user}&message=Cannot+delete:+Order+in+progress.",
             status_code=303
         )
 
-    # All linked orders are delivered, safe to delete order items
-    for item in order_items:
-        db.delete(item)
-
-        # Optional: Check if the order now has 0 items, then delete the order too
-        remaining_items = db.query(OrderItem).filter(OrderItem.order_id == item.order_id).count()
-        if remaining_items == 1:  # current item is the last one
-            order = db.query(Order).filter(Order.id == item.order_id).first()
-            if order:
-                db.delete(order)
+    if order_ids is None:
+        return templates.TemplateResponse(request, "message.html", {
+            "message": "Product not found."
+        })
 
-    # Finally, delete the product
-    db.delete(product)
-    db.commit()
+    catalog_cache.touch(db)
+    await db.commit()
+    await db.run_sync(search_backend().remove_product, product_id)
+    # Emptied orders are cleaned up after the response is sent
+    if order_ids:
+        background_tasks.add_task(purge_empty_orders, db.bind, order_ids)
     return RedirectResponse(f"/view-products?user={user}", status_code=303)
 
 # Add new product -> Role: Admin
-@app.get("/add-product", response_class=HTMLResponse)
-def add_product(request: Request, user: str, db: Session = Depends(get_db)):
-    context = get_user_context(user, db)
+@router.get("/add-product", response_class=HTMLResponse)
+async def add_product(request: Request, user: str, db: AsyncSession = Depends(get_db)):
+    context = await get_user_context(user, db)
     return templates.TemplateResponse(request, "add_product.html", {"username": context["username"], "role": context["role"]})
 
-@app.post("/add-product", response_class=HTMLResponse)
-def save_product(
+@router.post("/add-product", response_class=HTMLResponse)
+async def save_product(
     request: Request,
     user: str = Form(...),
     category: str = Form(...),
@@ -272,238 +402,483 @@ def save_product(
     brand: str = Form(...),
     productDesc: str = Form(...),
     quantity: int = Form(...),
-    price: float = Form(...)
+    price: float = Form(...),
+    db: AsyncSession = Depends(get_db)
 ):
-    db: Session = SessionLocal()
     try:
         new_product = Product(category=category, subcategory=subcategory, brand=brand, desc=productDesc, quantity=quantity, price=price)
         db.add(new_product)
-        db.commit()
-        db.refresh(new_product)
+        activity.record(db, "product", subject=subcategory)
+        await db.flush()
+        await db.run_sync(refresh_low_stock, [new_product.id])
+        catalog_cache.touch(db)
+        await db.commit()
+        await db.run_sync(search_backend().index_product, new_product)
         message = "Product added successfully!"
-        context = get_user_context(user, db)
+        context = await get_user_context(user, db)
         return templates.TemplateResponse(request, "add_product.html", { "username": context["username"], "role": context["role"], "success": message
         })
     except Exception as e:
-        db.rollback()
-        context = get_user_context(user, db)
+        await db.rollback()
+        context = await get_user_context(user, db)
         return templates.TemplateResponse(request, "add_product.html", { "username": context["username"], "role": context["role"], "error": str(e)
         })
-    finally:
-        db.close()
+
+# Bulk import / export -> Role: Admin
+@router.get("/export-products")
+async def export_products(request: Request, user: str = Query(...), format: str = "csv", db: AsyncSession = Depends(get_db)):
+    context = await get_user_context(user, db)
+    if not context:
+        return templates.TemplateResponse(request, "message.html", {"message": f"User '{user}' not found!", "redirect_url": "/login",
+                                                                    "username": user, "role": ""}, status_code=403)
+    if context["role"] != "admin":
+        return templates.TemplateResponse(request, "message.html", {
+            "message": "Only admins can export products.", "redirect_url": f"/dashboard?user={user}",
+            "username": context["username"], "role": context["role"]}, status_code=403)
+    if format == "ndjson":
+        body, media_type = export_ndjson(db.bind), "application/x-ndjson"
+    else:
+        format, body, media_type = "csv", export_csv(db.bind), "text/csv"
+    return StreamingResponse(body, media_type=media_type, headers={
+        "Content-Disposition": f"attachment; filename=products.{format}"
+    })
+
+@router.get("/import-products", response_class=HTMLResponse)
+async def import_products_page(request: Request, user: str = Query(...), db: AsyncSession = Depends(get_db)):
+    context = await get_user_context(user, db)
+    return templates.TemplateResponse(request, "import_products.html", {"username": context["username"], "role": context["role"]})
+
+@router.post("/import-products", response_class=HTMLResponse)
+async def import_products_upload(
+    request: Request,
+    user: str = Form(...),
+    file: UploadFile = File(...),
+    upsert: str = Form(""),
+    db: AsyncSession = Depends(get_db)
+):
+    context = await get_user_context(user, db)
+    fmt = "ndjson" if (file.filename or "").lower().endswith((".ndjson", ".jsonl", ".json")) else "csv"
+    summary = await db.run_sync(import_products, file.file, fmt=fmt, upsert=bool(upsert))
+    if summary.inserted or summary.updated:
+        search_backend().invalidate()
+        activity.record(db, "import", subject=f"Imported {summary.inserted} and updated {summary.updated} products")
+        await db.run_sync(refresh_low_stock)
+        catalog_cache.touch(db)
+        await db.commit()
+    return templates.TemplateResponse(request, "import_products.html", {
+        "username": context["username"],
+        "role": context["role"],
+        "summary": summary
+    })
 
 # Restock Product -> Role: Admin
-@app.get("/restock-products", response_class=HTMLResponse)
-def restock_products_page(request: Request, user: str = Query(...), db: Session = Depends(get_db)):
-    context = get_user_context(user, db)
-    products = db.query(Product).all()
+@router.get("/restock-products", response_class=HTMLResponse)
+async def restock_products_page(request: Request, user: str = Query(...), sort: str = DEFAULT_SORT, after: str = "",
+                          before: str = "", limit: int = PAGE_SIZE, db: AsyncSession = Depends(get_db)):
+    context = await get_user_context(user, db)
+    page = await db.run_sync(lambda session: paginate_products(session.query(Product), sort=sort, after=after, before=before, limit=limit))
     return templates.TemplateResponse(request, "restock_products.html", {
         "username": context["username"],
         "role": context["role"],
-        "products": products
+        "products": page,
+        "page": page,
+        "page_path": "/restock-products",
+        "sort_options": SORT_LABELS
     })
 
-@app.post("/restock-products", response_class=HTMLResponse)
-def restock_product(
+@router.post("/restock-products", response_class=HTMLResponse)
+async def restock_product(
     request: Request,
     user: str = Form(...),
     product_id: int = Form(...),
     added_quantity: int = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    context = get_user_context(user, db)
-    product = db.query(Product).filter(Product.id == product_id).first()
-    if product:
-        product.quantity += added_quantity
-        db.commit()
-        message = f"Successfully restocked {added_quantity} units of '{product.subcategory}'"
+    context = await get_user_context(user, db)
+    summary = await db.run_sync(restock_products, {product_id: added_quantity})
+    if summary.updated:
+        _, subcategory, _, _ = summary.updated[0]
+        activity.record(db, "restock", subject=subcategory, quantity=added_quantity)
+        catalog_cache.touch(db)
+        await db.commit()
+        message = f"Successfully restocked {added_quantity} units of '{subcategory}'"
     else:
+        await db.rollback()
         message = "Product not found"
 
-    products = db.query(Product).all()
+    page = await db.run_sync(lambda session: paginate_products(session.query(Product)))
     return templates.TemplateResponse(request, "restock_products.html", {
         "username": context["username"],
         "role": context["role"],
-        "products": products,
+        "products": page,
+        "page": page,
+        "page_path": "/restock-products",
+        "sort_options": SORT_LABELS,
         "message": message
     })
 
+# Batch restock: pasted "product_id,added_quantity" lines and/or an uploaded CSV
+@router.post("/restock-products/batch", response_class=HTMLResponse)
+async def restock_products_batch(
+    request: Request,
+    user: str = Form(...),
+    items: str = Form(""),
+    file: Union[UploadFile, str, None] = File(None),  # browsers send "" when no file is chosen
+    db: AsyncSession = Depends(get_db)
+):
+    context = await get_user_context(user, db)
+    increments, errors = parse_restock_lines(items.splitlines())
+    if file and not isinstance(file, str):
+        uploaded, upload_errors = parse_restock_upload(file.file)
+        for product_id, added in uploaded.items():
+            increments[product_id] = increments.get(product_id, 0) + added
+        errors += upload_errors
+
+    summary = await db.run_sync(restock_products, increments)
+    summary.errors = errors
+    if summary.updated:
+        activity.record(db, "restock", subject=f"{len(summary.updated)} products", quantity=summary.units)
+        catalog_cache.touch(db)
+    await db.commit()
+    return templates.TemplateResponse(request, "restock_summary.html", {
+        "username": context["username"],
+        "role": context["role"],
+        "summary": summary
+    })
+
+# Low stock report with restock suggestions -> Role: Admin
+@router.get("/low-stock", response_class=HTMLResponse)
+async def low_stock(request: Request, user: str = Query(...), db: AsyncSession = Depends(get_db)):
+    context = await get_user_context(user, db)
+    rows = await db.run_sync(low_stock_report)
+    return templates.TemplateResponse(request, "low_stock.html", {
+        "username": context["username"],
+        "role": context["role"],
+        "rows": rows,
+        "suggestions": "\n".join(f"{row.product_id},{row.suggested}" for row in rows)
+    })
+
+# Keyset paging and date-range arguments shared by the order listings, plus what the template needs to link pages
+def order_paging(after, before, limit, date_from, date_to):
+    paging = {"after": after, "before": before, "limit": limit,
+              "date_from": parse_date(date_from), "date_to": parse_date(date_to)}
+    filters = {key: paging[key].isoformat() for key in ("date_from", "date_to") if paging[key]}
+    return paging, filters
+
 # Manage Orders -> Role: Admin
-@app.get("/admin-orders", response_class=HTMLResponse)
-def view_all_orders(request: Request, user: str, db: Session = Depends(get_db)):
-    context = get_user_context(user, db)
-    orders = db.query(Order).filter(Order.status != "Delivered").all()
+@router.get("/admin-orders", response_class=HTMLResponse)
+async def view_all_orders(request: Request, user: str, after: str = "", before: str = "", limit: int = PAGE_SIZE,
+                          date_from: str = "", date_to: str = "", db: AsyncSession = Depends(get_db)):
+    context = await get_user_context(user, db)
+    paging, filters = order_paging(after, before, limit, date_from, date_to)
+    orders = await db.run_sync(lambda session: open_orders(session, **paging))
     return templates.TemplateResponse(request, "admin_orders.html", {
         "orders": orders,
+        "statuses": order_status.ORDER_STATUSES,
+        "updated": request.query_params.get("updated"),
+        "page": orders,
+        "page_path": "/admin-orders",
+        "filter_params": filters,
         "username": context["username"],
         "role": context["role"]
     })
 
 # Update status route -> Admin
-@app.post("/update-order-status/{order_id}", response_class=HTMLResponse)
-def update_order_status(
+@router.post("/update-order-status/{order_id}", response_class=HTMLResponse)
+async def update_order_status(
     order_id: int,
     status: str = Form(...),
     user: str = Form(...),  # Accept user from the form
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    order = db.query(Order).filter(Order.id == order_id).first()
+    order = await db.get(Order, order_id)
     if not order:
         return {"error": "Order not found"}
-    order.status = status
-    db.commit()
+    try:
+        await db.run_sync(order_status.set_order_status, status, order_ids=[order_id])
+    except order_status.InvalidStatus as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    await db.commit()
     return RedirectResponse(f"/admin-orders?user={user}", status_code=303)
 
+# Bulk status change -> Admin; the ticked orders, or every order in from_status placed on or before placed_before
+@router.post("/update-order-status", response_class=HTMLResponse)
+async def bulk_update_order_status(
+    request: Request,
+    status: str = Form(...),
+    user: str = Form(...),
+    order_ids: List[int] = Form([]),
+    from_status: str = Form(""),
+    placed_before: str = Form(""),
+    db: AsyncSession = Depends(get_db)
+):
+    context = await get_user_context(user, db)
+    if not context:
+        return templates.TemplateResponse(request, "message.html", {"message": f"User '{user}' not found!", "redirect_url": "/login",
+                                                                    "username": user, "role": ""}, status_code=403)
+    if context["role"] != "admin":
+        return templates.TemplateResponse(request, "message.html", {
+            "message": "Only admins can change order status.", "redirect_url": f"/dashboard?user={user}",
+            "username": context["username"], "role": context["role"]}, status_code=403)
+    try:
+        changed = await db.run_sync(order_status.set_order_status, status, order_ids=order_ids or None,
+                                    from_status=from_status, placed_before=parse_date(placed_before))
+    except order_status.InvalidStatus as e:
+        return templates.TemplateResponse(request, "message.html", {
+            "message": str(e), "redirect_url": f"/admin-orders?user={user}",
+            "username": context["username"], "role": context["role"]})
+    await db.commit()
+    return RedirectResponse(f"/admin-orders?user={user}&updated={len(changed)}", status_code=303)
+
+# Server-sent events: {"status", "order_ids"} as status changes commit; admins get every order, customers their own
+@router.get("/order-events")
+async def order_events(request: Request, user: str, db: AsyncSession = Depends(get_read_db)):
+    context = await get_user_context(user, db)
+    if not context:
+        return Response(status_code=404)
+    subscriber = order_status.broker.subscribe(None if context["role"] == "admin" else context["id"])
+
+    async def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), settings.ORDER_EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if subscriber.overflowed:
+                    # Fell behind; drop the backlog and let the page reload once
+                    while not subscriber.queue.empty():
+                        subscriber.queue.get_nowait()
+                    subscriber.overflowed = False
+                    yield "event: reload\ndata: {}\n\n"
+                    continue
+                yield f"event: status\ndata: {json.dumps(message)}\n\n"
+        finally:
+            order_status.broker.unsubscribe(subscriber)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # Sales history route -> Role: Admin 
-@app.get("/sales-history", response_class=HTMLResponse)
-def sales_history(request: Request, user: str, db: Session = Depends(get_db)):
-    context = get_user_context(user, db)
-    orders = db.query(Order).filter(Order.status == "Delivered").all()
+@router.get("/sales-history", response_class=HTMLResponse)
+async def sales_history(request: Request, user: str, after: str = "", before: str = "", limit: int = PAGE_SIZE,
+                        date_from: str = "", date_to: str = "", db: AsyncSession = Depends(get_read_db)):
+    context = await get_user_context(user, db)
+    paging, filters = order_paging(after, before, limit, date_from, date_to)
+    orders = await db.run_sync(lambda session: delivered_orders(session, **paging))
     return templates.TemplateResponse(request, "sales_history.html", {
         "orders": orders,
+        "page": orders,
+        "page_path": "/sales-history",
+        "filter_params": filters,
         "username": context["username"],
         "role": context["role"]
     })
  
-# Browse Product Route -> Role: Customer
-@app.get("/browse-products", response_class=HTMLResponse)
-def browse_products(request: Request, user: str, db: Session = Depends(get_db)):
-    context = get_user_context(user, db)
-    products = db.query(Product).all()
-    return templates.TemplateResponse(request, "browse_products.html", { "products": products, "username": context["username"], "role": context["role"]})
+# Sales analytics -> Role: Admin; totals grouped in SQL over any date range (the last 30 days by default)
+@router.get("/sales-analytics", response_class=HTMLResponse)
+async def sales_analytics(request: Request, user: str, group_by: str = "day", date_from: str = "", date_to: str = "",
+                          db: AsyncSession = Depends(get_read_db)):
+    context = await get_user_context(user, db)
+    if group_by not in analytics.DIMENSIONS:
+        group_by = "day"
+    end = parse_date(date_to) or date.today()
+    start = parse_date(date_from) or end - timedelta(days=29)
+    rows = await db.run_sync(analytics.sales_summary, group_by, start, end)
+    return templates.TemplateResponse(request, "sales_analytics.html", {
+        "username": context["username"],
+        "role": context["role"],
+        "rows": rows,
+        "group_by": group_by,
+        "dimensions": analytics.DIMENSIONS,
+        "date_from": start,
+        "date_to": end,
+        "totals": {
+            "revenue": sum(row.revenue for row in rows),
+            "units": sum(row.units for row in rows),
+            "orders": sum(row.orders for row in rows) if group_by in analytics.TIME_DIMENSIONS else None,
+        },
+    })
 
-# Add to cart route -> Role: Customer
-@app.post("/add-to-cart", response_class=HTMLResponse)
-def add_to_cart(user: str = Form(...), product_id: int = Form(...), quantity: int = Form(...), db: Session = Depends(get_db)):
-    user_obj = db.query(User).filter(User.username == user).first()
-    product = db.query(Product).filter(Product.id == product_id).first()
+# Ad-hoc pivot over the cached recent sales, e.g. rows=category&columns=week&measure=units -> Role: Admin
+@router.get("/sales-analytics/pivot")
+async def sales_pivot(user: str, rows: str = "category", columns: str = "", measure: str = "revenue", date_from: str = "",
+                      date_to: str = "", db: AsyncSession = Depends(get_read_db)):
+    context = await get_user_context(user, db)
+    if not context or context["role"] != "admin":
+        return JSONResponse({"error": "admin only"}, status_code=403)
+    # The cube only reads, so it is built from the replica when one is configured
+    cube = await analytics.sales_cube(read_engine)
+    try:
+        return cube.pivot(rows, columns or None, measure, parse_date(date_from), parse_date(date_to))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
 
-    if not user_obj or not product:
-        return RedirectResponse(f"/browse-products?user={user}", status_code=303)
+# Browse Product Route -> Role: Customer
+@router.get("/browse-products", response_class=HTMLResponse)
+async def browse_products(request: Request, user: str, sort: str = DEFAULT_SORT, after: str = "", before: str = "",
+                    limit: int = PAGE_SIZE, db: AsyncSession = Depends(get_read_db)):
+    context = await get_user_context(user, db)
+    version = await catalog_cache.version(db)
+    tag = catalog_cache.etag(version, context["username"], context["role"], sort, after, before, limit)
+    if request.headers.get("if-none-match") == tag:
+        return Response(status_code=304, headers={"ETag": tag})
+
+    # The product grid is the same for every customer; render it once per catalog version
+    key = (database_key(db.bind.sync_engine), version, sort, after, before, limit)
+    grid = catalog_cache.fragment_cache.get(key)
+    if grid is None:
+        page = await db.run_sync(lambda session: paginate_products(session.query(Product), sort=sort, after=after, before=before, limit=limit))
+        grid = templates.get_template("partials/product_grid.html").render({
+            "products": page,
+            "page": page,
+            "page_path": "/browse-products",
+            "sort_options": SORT_LABELS,
+            "username": catalog_cache.USER_PLACEHOLDER
+        })
+        catalog_cache.fragment_cache.put(key, grid)
 
-    existing_item = db.query(CartItem).filter(CartItem.user_id == user_obj.id, CartItem.product_id == product.id).first()
+    return templates.TemplateResponse(request, "browse_products.html", {
+        "grid": catalog_cache.personalize(grid, context["username"]),
+        "username": context["username"],
+        "role": context["role"]
+    }, headers={"ETag": tag, "Cache-Control": "private, no-cache"})
 
-    if existing_item:
-        existing_item.quantity += quantity
-    else:
-        new_cart_item = CartItem(user_id=user_obj.id, product_id=product.id, quantity=quantity)
-        db.add(new_cart_item)
+# Add to cart route -> Role: Customer
+@router.post("/add-to-cart", response_class=HTMLResponse)
+async def add_to_cart(request: Request, user: str = Form(...), product_id: int = Form(...), quantity: int = Form(...),
+                      db: AsyncSession = Depends(get_db)):
+    context = await get_user_context(user, db)
+    if not context or quantity < 1:
+        return RedirectResponse(f"/browse-products?user={user}", status_code=303)
 
-    db.commit()
+    # Holds the stock for RESERVATION_TTL seconds, so checkout cannot come up short
+    try:
+        await db.run_sync(reserve, context["id"], product_id, quantity)
+    except OutOfStock as e:
+        return templates.TemplateResponse(request, "message.html", {
+            "message": str(e),
+            "redirect_url": f"/browse-products?user={user}",
+            "username": context["username"],
+            "role": context["role"]
+        })
     return RedirectResponse(f"/browse-products?user={user}", status_code=303)
 
 # My cart view route -> Role: Customer
-@app.get("/my-cart", response_class=HTMLResponse)
-def my_cart(request: Request, user: str = Query(...), db: Session = Depends(get_db)):
-    context = get_user_context(user, db)
-    user_obj = db.query(User).filter(User.username == user).first()
-    cart_items = db.query(CartItem).filter(CartItem.user_id == user_obj.id).all()
-
-    subtotal = sum(item.quantity * item.product.price for item in cart_items)
-    gst = round(subtotal * 0.18, 2)
-    shipping = 50.0 if cart_items else 0.0
-    total_amount = round(subtotal + gst + shipping, 2)
+@router.get("/my-cart", response_class=HTMLResponse)
+async def my_cart(request: Request, user: str = Query(...), db: AsyncSession = Depends(get_db)):
+    context = await get_user_context(user, db)
+    cart = await db.run_sync(price_cart, context["id"])
 
     return templates.TemplateResponse(request, "my_cart.html", {
-        "cart_items": cart_items,
+        "cart_items": cart.lines,
         "username": context["username"],
         "role": context["role"],
-        "subtotal": subtotal,
-        "gst": gst,
-        "shipping": shipping,
-        "total_amount": total_amount
+        "subtotal": cart.subtotal,
+        "gst_percent": cart.gst_percent,
+        "gst": cart.gst,
+        "shipping": cart.shipping,
+        "total_amount": cart.total
     })
 
 # Remove from cart route -> Role: Customer
-@app.post("/remove-from-cart/{cart_id}")
-def remove_from_cart(cart_id: int, user: str = Form(...), db: Session = Depends(get_db)):
-    item = db.query(CartItem).filter(CartItem.id == cart_id).first()
-    if item:
-        db.delete(item)
-        db.commit()
+@router.post("/remove-from-cart/{cart_id}")
+async def remove_from_cart(cart_id: int, user: str = Form(...), db: AsyncSession = Depends(get_db)):
+    await db.run_sync(remove_cart_line, cart_id)
     return RedirectResponse(f"/my-cart?user={user}", status_code=303)
 
 # Proceed to buy route -> Role: Customer
-@app.post("/checkout", response_class=HTMLResponse)
-def checkout(request: Request, user: str = Form(...), db: Session = Depends(get_db)):
-    context = get_user_context(user, db)
+@router.post("/checkout", response_class=HTMLResponse)
+async def checkout(request: Request, user: str = Form(...), db: AsyncSession = Depends(get_db)):
+    context = await get_user_context(user, db)
     return templates.TemplateResponse(request, "message.html", {
         "message": "Proceeding to checkout... (To be implemented)",
         "redirect_url": f"/my-cart?user={user}"
     })
 
 # View Bill Route -> Role: Customer
-@app.post("/bill", response_class=HTMLResponse)
-def show_bill(request: Request, user: str = Form(...), db: Session = Depends(get_db)):
-    context = get_user_context(user, db)
-    user_obj = db.query(User).filter(User.username == user).first()
-    cart_items = db.query(CartItem).filter(CartItem.user_id == user_obj.id).all()
-
-    subtotal = sum(item.quantity * item.product.price for item in cart_items)
-    gst = round(subtotal * 0.18, 2)
-    shipping = 50.0 if cart_items else 0.0
-    total_amount = round(subtotal + gst + shipping, 2)
+@router.post("/bill", response_class=HTMLResponse)
+async def show_bill(request: Request, user: str = Form(...), db: AsyncSession = Depends(get_db)):
+    context = await get_user_context(user, db)
+    cart = await db.run_sync(price_cart, context["id"])
 
     return templates.TemplateResponse(request, "bill.html", {
         "username": context["username"],
         "role": context["role"],
-        "cart_items": cart_items,
-        "subtotal": subtotal,
-        "gst": gst,
-        "shipping": shipping,
-        "total_amount": total_amount
+        "cart_items": cart.lines,
+        "subtotal": cart.subtotal,
+        "gst_percent": cart.gst_percent,
+        "gst": cart.gst,
+        "shipping": cart.shipping,
+        "total_amount": cart.total
     })
 
 # confirm buy route -> Role: Customer
-@app.post("/confirm-buy", response_class=HTMLResponse)
-def confirm_buy(request: Request, user: str = Form(...), db: Session = Depends(get_db)):
+@router.post("/confirm-buy", response_class=HTMLResponse)
+async def confirm_buy(request: Request, user: str = Form(...), db: AsyncSession = Depends(get_db)):
     # Get user
-    user_obj = db.query(User).filter(User.username == user).first()
-    if not user_obj:
+    context = await get_user_context(user, db)
+    if not context:
         return templates.TemplateResponse(request, "message.html", {
             "message": "User not found.",
             "redirect_url": "/login"
         })
 
-    # Get cart items
-    cart_items = db.query(CartItem).filter(CartItem.user_id == user_obj.id).all()
-    if not cart_items:
+    try:
+        order_id = await db.run_sync(place_order, context["id"])
+    except CheckoutError as e:
+        return templates.TemplateResponse(request, "message.html", {
+            "message": str(e),
+            "redirect_url": f"/my-cart?user={user}",
+            "username": context["username"],
+            "role": context["role"]
+        })
+
+    if order_id is None:
         return templates.TemplateResponse(request, "message.html", {
             "message": "Your cart is empty.",
-            "redirect_url": f"/my-cart?user={user}"
+            "redirect_url": f"/my-cart?user={user}",
+            "username": context["username"],
+            "role": context["role"]
         })
 
-    # Create order
-    new_order = Order(user_id=user_obj.id)
-    db.add(new_order)
-    db.commit()
-    db.refresh(new_order)
+    return RedirectResponse(f"/my-cart?user={user}", status_code=303)
 
-    # Move items from cart to order_items
-    for item in cart_items:
-        order_item = OrderItem(order_id=new_order.id, product_id=item.product.id, quantity=item.quantity)
-        db.add(order_item)
-        item.product.quantity -= item.quantity  # reduce stock
+# Order history shown route -> Role: Customer
+@router.get("/order-history", response_class=HTMLResponse)
+async def order_history(request: Request, user: str = Query(...), after: str = "", before: str = "", limit: int = PAGE_SIZE,
+                        date_from: str = "", date_to: str = "", db: AsyncSession = Depends(get_read_db)):
+    context = await get_user_context(user, db)
 
-    # Clear cart
-    for item in cart_items:
-        db.delete(item)
+    if not context:
+        return templates.TemplateResponse(request, "message.html", {"message": f"User '{user}' not found!", "redirect_url": "/login"})
 
-    db.commit()
 
-    return RedirectResponse(f"/my-cart?user={user}", status_code=303)
+    paging, filters = order_paging(after, before, limit, date_from, date_to)
+    orders = await db.run_sync(lambda session: user_orders(session, context["id"], **paging))
+    return templates.TemplateResponse(request, "order_history.html", {
+        "orders": orders, "page": orders, "page_path": "/order-history", "filter_params": filters,
+        "username": context["username"], "role": context["role"]})
 
-# Order history shown route -> Role: Customer
-@app.get("/order-history", response_class=HTMLResponse)
-def order_history(request: Request, user: str = Query(...), db: Session = Depends(get_db)):
-    context = get_user_context(user, db)
-    user_obj = db.query(User).filter(User.username == user).first()
 
-    if not user_obj:
-        return templates.TemplateResponse(request, "message.html", {"message": f"User '{user}' not found!", "redirect_url": "/login"})
+# ?user= edited to someone other than the signed-in user: the API answers 401, pages send them to sign in
+async def session_mismatch(request: Request, exc: SessionMismatch):
+    if request.url.path.startswith(api.router.prefix):
+        return JSONResponse({"error": str(exc)}, status_code=401)
+    return RedirectResponse(url="/login", status_code=303)
 
 
-    orders = db.query(Order).filter(Order.user_id == user_obj.id).all()
-    return templates.TemplateResponse(request, "order_history.html", { "orders": orders, "username": context["username"], "role": context["role"]})
+def create_app():
+    application = FastAPI(lifespan=lifespan)
+    application.add_exception_handler(SessionMismatch, session_mismatch)
+    # Registered innermost first: load_session runs inside record_metrics
+    application.middleware("http")(load_session)
+    application.middleware("http")(record_metrics)
+    application.mount("/static", StaticFiles(directory="static"), name="static")
+    application.include_router(router)
+    application.include_router(api.router)
+    return application
 
 
+app = create_app()
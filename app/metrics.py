@@ -0,0 +1,136 @@
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from config import settings
+from database import pool_status
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# SQL work done while serving one request
+class RequestStats:
+    def __init__(self):
+        self.statements = 0
+        self.db_time = 0.0
+        self.rows_affected = 0
+
+
+# Stats of the request being served; set by the metrics middleware in main.py
+current_request = ContextVar("current_request", default=None)
+
+
+# Listening on the Engine class covers every engine, including the sync side of async engines
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_request.get() is not None:
+        conn.info["query_started"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_request.get()
+    started = conn.info.pop("query_started", None)
+    if stats is None or started is None:
+        return
+    stats.statements += 1
+    stats.db_time += time.perf_counter() - started
+    # Only DML: drivers disagree on rowcount for SELECT (MySQL reports the result size, SQLite -1)
+    if (context.isinsert or context.isupdate or context.isdelete) and cursor.rowcount and cursor.rowcount > 0:
+        stats.rows_affected += cursor.rowcount
+
+
+class RouteSeries:
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.latency = 0.0
+        self.statuses = {}
+        self.statements = 0
+        self.db_time = 0.0
+        self.rows_affected = 0
+        self.over_budget = 0
+
+
+# Per-route totals since process start, keyed by (method, route template)
+class MetricsRegistry:
+    def __init__(self):
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, method, route, status, latency, stats):
+        with self._lock:
+            series = self._series.setdefault((method, route), RouteSeries())
+            series.count += 1
+            series.latency += latency
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    series.buckets[index] += 1
+            series.statuses[status] = series.statuses.get(status, 0) + 1
+            series.statements += stats.statements
+            series.db_time += stats.db_time
+            series.rows_affected += stats.rows_affected
+            over_budget = stats.statements > settings.QUERY_BUDGET
+            if over_budget:
+                series.over_budget += 1
+        if over_budget:
+            logger.warning("%s %s ran %d SQL statements (budget %d, %.1f ms in the database)",
+                           method, route, stats.statements, settings.QUERY_BUDGET, stats.db_time * 1000)
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            series = sorted(self._series.items())
+
+            family("http_requests_total", "counter", "Requests served, by route template and status.")
+            for (method, route), s in series:
+                for status, count in sorted(s.statuses.items()):
+                    lines.append(f'http_requests_total{{method="{method}",route="{route}",status="{status}"}} {count}')
+
+            family("http_request_duration_seconds", "histogram", "Request latency, by route template.")
+            for (method, route), s in series:
+                labels = f'method="{method}",route="{route}"'
+                for bound, count in zip(LATENCY_BUCKETS, s.buckets):
+                    lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {s.count}')
+                lines.append(f"http_request_duration_seconds_sum{{{labels}}} {s.latency:.6f}")
+                lines.append(f"http_request_duration_seconds_count{{{labels}}} {s.count}")
+
+            for name, help_text, attribute, fmt in (
+                ("db_statements_total", "SQL statements executed.", "statements", "{}"),
+                ("db_time_seconds_total", "Time spent executing SQL.", "db_time", "{:.6f}"),
+                ("db_rows_affected_total", "Rows inserted, updated or deleted.", "rows_affected", "{}"),
+                ("db_query_budget_exceeded_total", "Requests that ran more than QUERY_BUDGET statements.", "over_budget", "{}"),
+            ):
+                family(name, "counter", f"{help_text} By route template.")
+                for (method, route), s in series:
+                    lines.append(f'{name}{{method="{method}",route="{route}"}} ' + fmt.format(getattr(s, attribute)))
+
+        pools = pool_status()
+        for name, kind, key, scale in (
+            ("db_pool_checked_out", "gauge", "checked_out", 1),
+            ("db_pool_checkouts_total", "counter", "checkouts", 1),
+            ("db_pool_timeouts_total", "counter", "timeouts", 1),
+            ("db_pool_wait_seconds_total", "counter", "wait_ms_total", 0.001),
+        ):
+            family(name, kind, "Connection pool usage, by engine.")
+            for engine_name, snapshot in pools.items():
+                lines.append(f'{name}{{engine="{engine_name}"}} {snapshot[key] * scale:g}')
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,188 @@
+from datetime import datetime
+from sqlalchemy import func, inspect, insert, select, update, delete
+from database import Base
+from models import SchemaMigration, CartItem
+from inventory import sync_low_stock
+from search import fts5_available
+import models
+
+
+# Each step takes a connection inside a transaction and must be safe to run against
+# a database that create_all already brought up to date (fresh installs do that in step 1).
+
+def _initial_schema(conn):
+    Base.metadata.create_all(conn)
+
+
+def _has_index(conn, table, columns):
+    return any(index["column_names"] == list(columns) for index in inspect(conn).get_indexes(table))
+
+
+# Spelled out rather than taken from the models, which describe the latest schema: a step
+# must keep creating what it created when it was written
+def _create_index(conn, table, name, columns, unique=False):
+    if _has_index(conn, table, columns):
+        return
+    quote = conn.dialect.identifier_preparer.quote
+    conn.exec_driver_sql(
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX {quote(name)} ON {quote(table)} ({', '.join(map(quote, columns))})"
+    )
+
+
+def _add_column(conn, column):
+    table = column.table
+    if column.name in {existing["name"] for existing in inspect(conn).get_columns(table.name)}:
+        return
+    quote = conn.dialect.identifier_preparer.quote
+    conn.exec_driver_sql(
+        f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column.type.compile(conn.dialect)}"
+    )
+
+
+def _merge_duplicate_cart_items(conn):
+    # Keep the oldest row per (user, product) with the summed quantity; needed before the unique index
+    duplicates = conn.execute(
+        select(CartItem.user_id, CartItem.product_id, func.min(CartItem.id), func.sum(CartItem.quantity))
+        .group_by(CartItem.user_id, CartItem.product_id)
+        .having(func.count() > 1)
+    ).all()
+    for user_id, product_id, keep_id, quantity in duplicates:
+        conn.execute(update(CartItem).where(CartItem.id == keep_id).values(quantity=quantity))
+        conn.execute(delete(CartItem).where(
+            CartItem.user_id == user_id, CartItem.product_id == product_id, CartItem.id != keep_id
+        ))
+
+
+# (table, name, columns, unique) added by version 2
+SECONDARY_INDEXES = [
+    ("products", "ix_products_quantity", ["quantity"], False),
+    ("orders", "ix_orders_status_date", ["status", "date"], False),
+    ("orders", "ix_orders_user_id_date", ["user_id", "date"], False),
+    ("orders", "ix_orders_date", ["date"], False),
+    ("order_items", "ix_order_items_order_id", ["order_id"], False),
+    ("order_items", "ix_order_items_product_id", ["product_id"], False),
+    ("cart_items", "uq_cart_items_user_product", ["user_id", "product_id"], True),
+]
+
+
+def _secondary_indexes(conn):
+    _merge_duplicate_cart_items(conn)
+    for table, name, columns, unique in SECONDARY_INDEXES:
+        _create_index(conn, table, name, columns, unique)
+
+
+def _low_stock(conn):
+    _add_column(conn, models.Product.__table__.c.reorder_level)
+    models.LowStock.__table__.create(conn, checkfirst=True)
+    sync_low_stock(conn)
+
+
+def _order_totals(conn):
+    _add_column(conn, models.OrderItem.__table__.c.unit_price)
+    _add_column(conn, models.Order.__table__.c.item_count)
+    _add_column(conn, models.Order.__table__.c.total_amount)
+    # Older orders only have today's price to go by
+    conn.execute(
+        update(models.OrderItem)
+        .where(models.OrderItem.unit_price.is_(None))
+        .values(unit_price=select(models.Product.price).where(models.Product.id == models.OrderItem.product_id).scalar_subquery())
+    )
+    conn.execute(
+        update(models.Order)
+        .where(models.Order.total_amount.is_(None))
+        .values(
+            item_count=select(func.coalesce(func.sum(models.OrderItem.quantity), 0))
+            .where(models.OrderItem.order_id == models.Order.id).scalar_subquery(),
+            total_amount=select(func.coalesce(func.sum(models.OrderItem.quantity * models.OrderItem.unit_price), 0))
+            .where(models.OrderItem.order_id == models.Order.id).scalar_subquery(),
+        )
+    )
+
+
+def _cart_reservations(conn):
+    _add_column(conn, CartItem.__table__.c.reserved)
+    _add_column(conn, CartItem.__table__.c.reserved_until)
+    # Existing cart lines hold nothing; checkout takes their stock as before
+    conn.execute(update(CartItem).where(CartItem.reserved.is_(None)).values(reserved=0))
+    _create_index(conn, "cart_items", "ix_cart_items_reserved_until", ["reserved_until"])
+    _create_index(conn, "cart_items", "ix_cart_items_product_id", ["product_id"])
+
+
+# Built here, on the primary, so the search path only ever reads (replicas get it by replication).
+# Other databases, and SQLite builds without FTS5, search with the in-process index instead
+def _search_index(conn):
+    if conn.dialect.name == "mysql":
+        if not conn.exec_driver_sql("SHOW INDEX FROM products WHERE Key_name = 'ix_products_fulltext'").first():
+            conn.exec_driver_sql("CREATE FULLTEXT INDEX ix_products_fulltext ON products (category, subcategory, brand, `desc`)")
+    elif conn.dialect.name == "sqlite" and fts5_available(conn):
+        created = not conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE name = 'products_fts'").first()
+        conn.exec_driver_sql(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5("
+            "category, subcategory, brand, \"desc\", content='products', content_rowid='id')"
+        )
+        conn.exec_driver_sql(
+            "CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN "
+            "INSERT INTO products_fts(rowid, category, subcategory, brand, \"desc\") "
+            "VALUES (new.id, new.category, new.subcategory, new.brand, new.\"desc\"); END"
+        )
+        conn.exec_driver_sql(
+            "CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN "
+            "INSERT INTO products_fts(products_fts, rowid, category, subcategory, brand, \"desc\") "
+            "VALUES ('delete', old.id, old.category, old.subcategory, old.brand, old.\"desc\"); END"
+        )
+        conn.exec_driver_sql(
+            "CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF category, subcategory, brand, \"desc\" "
+            "ON products BEGIN "
+            "INSERT INTO products_fts(products_fts, rowid, category, subcategory, brand, \"desc\") "
+            "VALUES ('delete', old.id, old.category, old.subcategory, old.brand, old.\"desc\"); "
+            "INSERT INTO products_fts(rowid, category, subcategory, brand, \"desc\") "
+            "VALUES (new.id, new.category, new.subcategory, new.brand, new.\"desc\"); END"
+        )
+        if created:
+            conn.exec_driver_sql("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+
+def _catalog_version(conn):
+    models.CatalogVersion.__table__.create(conn, checkfirst=True)
+    if not conn.execute(select(models.CatalogVersion.id)).first():
+        conn.execute(insert(models.CatalogVersion).values(id=1, version=0))
+
+# (version, name, step) in the order they must run; append new steps, never edit applied ones
+MIGRATIONS = [
+    (1, "initial schema", _initial_schema),
+    (2, "secondary indexes and unique cart lines", _secondary_indexes),
+    (3, "reorder levels and maintained low-stock table", _low_stock),
+    (4, "order item prices and order totals", _order_totals),
+    (5, "stock reservations on cart lines", _cart_reservations),
+    (6, "full-text product search index", _search_index),
+    (7, "shared catalog cache version", _catalog_version),
+]
+
+
+def applied_versions(conn):
+    SchemaMigration.__table__.create(conn, checkfirst=True)
+    return set(conn.execute(select(SchemaMigration.version)).scalars())
+
+
+# Applies pending migrations in order, each in its own transaction; returns the versions applied
+def upgrade(engine):
+    with engine.begin() as conn:
+        applied = applied_versions(conn)
+    done = []
+    for version, name, step in MIGRATIONS:
+        if version in applied:
+            continue
+        with engine.begin() as conn:
+            step(conn)
+            conn.execute(insert(SchemaMigration).values(version=version, name=name, applied_at=datetime.now()))
+        done.append(version)
+    return done
+
+
+# Deploy step: `python migrations.py` once, then start the workers with RUN_MIGRATIONS=0
+if __name__ == "__main__":
+    from database import engine, SessionLocal
+    from rollups import backfill_if_empty
+
+    print("applied:", upgrade(engine) or "nothing")
+    with SessionLocal() as db:
+        backfill_if_empty(db)
@@ -1,7 +1,7 @@
 from fastapi import FastAPI
 from database import Base
-from datetime import date
-from sqlalchemy import Column, Integer, String, Float, Date, ForeignKey
+from datetime import date, datetime
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 
 class User(Base):
@@ -27,6 +27,11 @@ class Product(Base):
     quantity = Column(Integer, default=0)
     price = Column(Float, nullable=False)
     date = Column(Date, default=date.today)
+    # Below this quantity the product is low on stock; NULL uses settings.LOW_STOCK_THRESHOLD
+    reorder_level = Column(Integer, nullable=True)
+
+    # Low-stock counts and reports filter on quantity
+    __table_args__ = (Index("ix_products_quantity", "quantity"),)
 
     def __repr__(self):
         return f"<Product(name={self.name}, qty={self.quantity})>"
@@ -37,10 +42,20 @@ class Order(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     date = Column(Date, default=date.today)
     status = Column(String(50), default="Pending")
+    # Snapshot taken at checkout: units ordered and merchandise value (sum of quantity x unit_price)
+    item_count = Column(Integer, nullable=True)
+    total_amount = Column(Float, nullable=True)
     
     user = relationship("User", back_populates="orders")
     items = relationship("OrderItem", back_populates="order")
 
+    # Status listings (admin orders, sales history), per-customer history and per-day lookups
+    __table_args__ = (
+        Index("ix_orders_status_date", "status", "date"),
+        Index("ix_orders_user_id_date", "user_id", "date"),
+        Index("ix_orders_date", "date"),
+    )
+
     def __repr__(self):
         return f"<Order(id={self.id}, user_id={self.user_id}, status={self.status})>"
 
@@ -50,10 +65,17 @@ class OrderItem(Base):
     order_id = Column(Integer, ForeignKey("orders.id"))
     product_id = Column(Integer, ForeignKey("products.id"))
     quantity = Column(Integer)
+    # Price paid, so later price edits do not rewrite history
+    unit_price = Column(Float, nullable=True)
 
     order = relationship("Order", back_populates="items")
     product = relationship("Product")
 
+    __table_args__ = (
+        Index("ix_order_items_order_id", "order_id"),
+        Index("ix_order_items_product_id", "product_id"),
+    )
+
     def __repr__(self):
         return f"<OrderItem(order_id={self.order_id}, product_id={self.product_id}, quantity={self.quantity})>"
 
@@ -63,6 +85,69 @@ class CartItem(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     product_id = Column(Integer, ForeignKey("products.id"))
     quantity = Column(Integer, nullable=False)
+    # Units of quantity whose stock is held for this cart (already taken off Product.quantity)
+    # until reserved_until; the sweeper gives expired holds back. See reservations.py
+    reserved = Column(Integer, nullable=False, default=0)
+    reserved_until = Column(DateTime, nullable=True)
 
     user = relationship("User")
     product = relationship("Product")
+
+    # One row per product per cart; also serves cart lookups by user. The sweeper scans by expiry,
+    # admin stock edits sum the holds per product
+    __table_args__ = (
+        Index("uq_cart_items_user_product", "user_id", "product_id", unique=True),
+        Index("ix_cart_items_reserved_until", "reserved_until"),
+        Index("ix_cart_items_product_id", "product_id"),
+    )
+
+# Products currently below their reorder level, kept in step by inventory.refresh_low_stock
+class LowStock(Base):
+    __tablename__ = "low_stock"
+    product_id = Column(Integer, primary_key=True, autoincrement=False)
+    quantity = Column(Integer, nullable=False)
+    reorder_level = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return f"<LowStock(product_id={self.product_id}, quantity={self.quantity}, reorder_level={self.reorder_level})>"
+
+# Single row (id 1) bumped with every catalog write; see catalog_cache.version
+class CatalogVersion(Base):
+    __tablename__ = "catalog_version"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    version = Column(Integer, nullable=False, default=0)
+
+# Versions applied by migrations.upgrade()
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String(100), nullable=False)
+    applied_at = Column(DateTime, default=datetime.now, nullable=False)
+
+# Per-day, per-product sales rollup maintained at checkout
+class DailySales(Base):
+    __tablename__ = "daily_sales"
+    day = Column(Date, primary_key=True)
+    product_id = Column(Integer, primary_key=True)
+    units = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0.0)
+
+    def __repr__(self):
+        return f"<DailySales(day={self.day}, product_id={self.product_id}, units={self.units}, revenue={self.revenue})>"
+
+# Append-only activity feed written by the admin and checkout routes
+class ActivityLog(Base):
+    __tablename__ = "activity_log"
+    id = Column(Integer, primary_key=True, index=True)
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+    kind = Column(String(20), nullable=False)
+    user_id = Column(Integer, nullable=True)
+    order_id = Column(Integer, nullable=True)
+    subject = Column(String(255), default="")
+    quantity = Column(Integer, nullable=True)
+    status = Column(String(50), nullable=True)
+
+    __table_args__ = (Index("ix_activity_log_user_id_id", "user_id", "id"),)
+
+    def __repr__(self):
+        return f"<ActivityLog(kind={self.kind}, subject={self.subject}, user_id={self.user_id})>"
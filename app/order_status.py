@@ -0,0 +1,112 @@
+import asyncio
+import threading
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+from models import Order
+import activity
+
+ORDER_STATUSES = ("Pending", "Shipped", "Delivered")
+# Filters never move orders out of these; naming the order ids (or from_status) still can
+TERMINAL_STATUSES = ("Delivered",)
+# Above this many orders, one summary activity entry replaces the per-order ones
+MAX_STATUS_ALERTS = 10
+# Messages buffered per open page; a client that falls further behind is told to reload
+SUBSCRIBER_QUEUE = 100
+
+
+class InvalidStatus(Exception):
+    pass
+
+
+# Moves the selected orders to `status` with a single UPDATE; orders are picked by id and/or by
+# current status and date. A date filter without from_status leaves TERMINAL_STATUSES alone.
+# Joins the caller's transaction and returns the ids that changed.
+def set_order_status(db: Session, status, order_ids=None, from_status=None, placed_before=None):
+    if status not in ORDER_STATUSES:
+        raise InvalidStatus(f"Unknown status: {status}")
+    criteria = [Order.status != status]
+    if order_ids is not None:
+        criteria.append(Order.id.in_(list(order_ids)))
+    if from_status:
+        criteria.append(Order.status == from_status)
+    if placed_before is not None:
+        criteria.append(Order.date <= placed_before)
+    if len(criteria) == 1:
+        raise InvalidStatus("Select orders or a filter")
+    if order_ids is None and not from_status:
+        criteria.append(Order.status.notin_(TERMINAL_STATUSES))
+
+    changed = db.execute(select(Order.id, Order.user_id).where(*criteria).with_for_update()).all()
+    if not changed:
+        return []
+    ids = [order_id for order_id, _ in changed]
+    db.execute(update(Order).where(Order.id.in_(ids)).values(status=status).execution_options(synchronize_session=False))
+
+    if len(changed) > MAX_STATUS_ALERTS:
+        activity.record(db, "status", subject=f"{len(changed)} orders", quantity=len(changed), status=status)
+    else:
+        for order_id, user_id in changed:
+            activity.record(db, "status", user_id=user_id, order_id=order_id, status=status)
+    db.info.setdefault("pending_status", []).append((status, changed))
+    return ids
+
+
+# One open event stream; user_id is None for admins, who see every order
+class Subscriber:
+    def __init__(self, loop, user_id=None):
+        self.loop = loop
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE)
+        self.overflowed = False
+
+    def _offer(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+# Fans committed status changes out to the event streams open in this process. Like the
+# catalog version, it is per worker: pages served by another worker only see their own changes.
+class OrderEventBroker:
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id=None):
+        subscriber = Subscriber(asyncio.get_running_loop(), user_id)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    # changed: [(order_id, user_id)]; safe to call from any thread
+    def publish(self, status, changed):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            order_ids = [order_id for order_id, user_id in changed
+                         if subscriber.user_id is None or user_id == subscriber.user_id]
+            if not order_ids:
+                continue
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber._offer, {"status": status, "order_ids": order_ids})
+            except RuntimeError:
+                self.unsubscribe(subscriber)  # its event loop is gone
+
+
+broker = OrderEventBroker()
+
+
+@event.listens_for(Session, "after_commit")
+def _publish(session):
+    for status, changed in session.info.pop("pending_status", ()):
+        broker.publish(status, changed)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session):
+    session.info.pop("pending_status", None)
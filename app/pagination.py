@@ -0,0 +1,143 @@
+import base64
+from datetime import date
+from sqlalchemy import and_, or_
+from models import Product
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# sort key -> (column, descending); Product.id is always the tie-breaker
+SORT_OPTIONS = {
+    "id": (Product.id, False),
+    "-id": (Product.id, True),
+    "date": (Product.date, False),
+    "-date": (Product.date, True),
+}
+SORT_LABELS = {
+    "id": "Oldest first",
+    "-id": "Newest first",
+    "date": "Date added (oldest)",
+    "-date": "Date added (newest)",
+}
+DEFAULT_SORT = "id"
+
+
+class Page:
+    def __init__(self, items, sort, limit, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.sort = sort
+        self.limit = limit
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def clamp_limit(limit):
+    if not limit or limit < 1:
+        return PAGE_SIZE
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def parse_date(value):
+    # Optional YYYY-MM-DD query parameter; anything else means no bound
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+def encode_date_key(day, row_id):
+    return base64.urlsafe_b64encode(f"{day.isoformat()}|{row_id}".encode()).decode().rstrip("=")
+
+
+def decode_date_key(cursor):
+    # (date, id) from encode_date_key, or None for a missing / tampered cursor
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        day, row_id = raw.split("|")
+        return date.fromisoformat(day), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def encode_cursor(product, sort):
+    column, _ = SORT_OPTIONS[sort]
+    if column is Product.id:
+        raw = str(product.id)
+    else:
+        raw = f"{product.date.isoformat()}|{product.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, sort):
+    # Returns (sort value, id) or None for a missing / tampered cursor
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        column, _ = SORT_OPTIONS[sort]
+        if column is Product.id:
+            product_id = int(raw)
+            return product_id, product_id
+        day, product_id = raw.split("|")
+        return date.fromisoformat(day), int(product_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _seek(column, value, last_id, ascending):
+    # Rows strictly past (value, last_id) in the direction the query is ordered
+    if column is Product.id:
+        return Product.id > last_id if ascending else Product.id < last_id
+    if ascending:
+        return or_(column > value, and_(column == value, Product.id > last_id))
+    return or_(column < value, and_(column == value, Product.id < last_id))
+
+
+def _order_by(column, ascending):
+    if column is Product.id:
+        return (Product.id.asc(),) if ascending else (Product.id.desc(),)
+    if ascending:
+        return column.asc(), Product.id.asc()
+    return column.desc(), Product.id.desc()
+
+
+def paginate_products(query, sort=DEFAULT_SORT, after="", before="", limit=PAGE_SIZE):
+    if sort not in SORT_OPTIONS:
+        sort = DEFAULT_SORT
+    limit = clamp_limit(limit)
+    column, descending = SORT_OPTIONS[sort]
+
+    after_key = decode_cursor(after, sort)
+    before_key = decode_cursor(before, sort) if after_key is None else None
+
+    # Paging backwards runs the query in reverse order and flips the slice back
+    backwards = before_key is not None
+    ascending = descending == backwards
+    key = before_key if backwards else after_key
+    if key is not None:
+        query = query.filter(_seek(column, key[0], key[1], ascending))
+
+    rows = query.order_by(*_order_by(column, ascending)).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if backwards:
+            prev_cursor = encode_cursor(rows[0], sort) if has_more else None
+            next_cursor = encode_cursor(rows[-1], sort)
+        else:
+            next_cursor = encode_cursor(rows[-1], sort) if has_more else None
+            prev_cursor = encode_cursor(rows[0], sort) if after_key is not None else None
+
+    return Page(rows, sort, limit, next_cursor=next_cursor, prev_cursor=prev_cursor)
@@ -0,0 +1,88 @@
+from decimal import Decimal, ROUND_HALF_UP
+from sqlalchemy.orm import Session
+from config import settings
+from models import Product, CartItem
+
+CENT = Decimal("0.01")
+
+
+# Prices are stored as floats; go through str() so 999.99 stays 999.99
+def to_money(value):
+    return Decimal(str(value)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+class PricingRules:
+    def __init__(self, gst_rate, shipping, free_shipping_over=None):
+        self.gst_rate = Decimal(str(gst_rate))
+        self.shipping = to_money(shipping)
+        self.free_shipping_over = to_money(free_shipping_over) if free_shipping_over not in (None, "") else None
+
+    @classmethod
+    def from_settings(cls):
+        return cls(settings.GST_RATE, settings.SHIPPING_FEE, settings.FREE_SHIPPING_OVER)
+
+    @property
+    def gst_percent(self):
+        return (self.gst_rate * 100).normalize()
+
+    def shipping_for(self, subtotal):
+        if not subtotal:
+            return Decimal("0.00")
+        if self.free_shipping_over is not None and subtotal >= self.free_shipping_over:
+            return Decimal("0.00")
+        return self.shipping
+
+
+class CartLine:
+    __slots__ = ("id", "user_id", "product_id", "subcategory", "brand", "desc", "price", "quantity", "line_total")
+
+    def __init__(self, id, user_id, product_id, subcategory, brand, desc, price, quantity):
+        self.id = id
+        self.user_id = user_id
+        self.product_id = product_id
+        self.subcategory = subcategory
+        self.brand = brand
+        self.desc = desc
+        self.price = to_money(price)
+        self.quantity = quantity
+        self.line_total = self.price * quantity
+
+
+class CartQuote:
+    def __init__(self, lines, rules):
+        self.lines = lines
+        self.gst_percent = rules.gst_percent
+        self.subtotal = sum((line.line_total for line in lines), Decimal("0.00"))
+        self.gst = (self.subtotal * rules.gst_rate).quantize(CENT, rounding=ROUND_HALF_UP)
+        self.shipping = rules.shipping_for(self.subtotal)
+        self.total = self.subtotal + self.gst + self.shipping
+
+    @property
+    def units(self):
+        return sum(line.quantity for line in self.lines)
+
+
+# Cart lines with their product fields, from one join over any number of carts
+def cart_lines(db: Session, *criteria):
+    rows = (
+        db.query(CartItem.id, CartItem.user_id, CartItem.product_id, Product.subcategory, Product.brand,
+                 Product.desc, Product.price, CartItem.quantity)
+        .join(Product, Product.id == CartItem.product_id)
+        .filter(*criteria)
+        .order_by(CartItem.user_id, CartItem.id)
+    )
+    return [CartLine(*row) for row in rows]
+
+
+def price_cart(db: Session, user_id: int, rules=None):
+    return CartQuote(cart_lines(db, CartItem.user_id == user_id), rules or PricingRules.from_settings())
+
+
+# {user_id: CartQuote} for many carts in one query; every non-empty cart when user_ids is None
+def price_carts(db: Session, user_ids=None, rules=None):
+    rules = rules or PricingRules.from_settings()
+    criteria = [] if user_ids is None else [CartItem.user_id.in_(list(user_ids))]
+    carts = {}
+    for line in cart_lines(db, *criteria):
+        carts.setdefault(line.user_id, []).append(line)
+    return {user_id: CartQuote(lines, rules) for user_id, lines in carts.items()}
@@ -0,0 +1,158 @@
+from sqlalchemy import func, select, and_, or_, null
+from sqlalchemy.orm import Session
+from models import User, Product, Order, OrderItem, DailySales, LowStock
+from pagination import Page, PAGE_SIZE, clamp_limit, encode_date_key, decode_date_key
+from inventory import still_low
+
+
+# Read-only rows for the order listing pages, built from one flattened join
+class OrderItemRow:
+    __slots__ = ("product_id", "subcategory", "brand", "quantity", "unit_price")
+
+    def __init__(self, product_id, subcategory, brand, quantity, unit_price):
+        self.product_id = product_id
+        self.subcategory = subcategory
+        self.brand = brand
+        self.quantity = quantity
+        self.unit_price = unit_price
+
+
+class OrderRow:
+    __slots__ = ("id", "user_id", "username", "date", "status", "item_count", "total_amount", "items")
+
+    def __init__(self, id, user_id, username, date, status, item_count, total_amount):
+        self.id = id
+        self.user_id = user_id
+        self.username = username
+        self.date = date
+        self.status = status
+        self.item_count = item_count
+        self.total_amount = total_amount
+        self.items = []
+
+
+def _order_seek(day, order_id, ascending):
+    if ascending:
+        return or_(Order.date > day, and_(Order.date == day, Order.id > order_id))
+    return or_(Order.date < day, and_(Order.date == day, Order.id < order_id))
+
+
+def _order_by(ascending):
+    if ascending:
+        return Order.date.asc(), Order.id.asc()
+    return Order.date.desc(), Order.id.desc()
+
+
+# One page of orders, newest first, keyed on (date, id). The page of order ids is picked
+# in a derived table (MySQL refuses LIMIT inside IN) and joined to the items in the same query;
+# with_items=False leaves the items out (and their joins), for callers that only need the totals;
+# with_username=False leaves out the users join and username comes back as None.
+def fetch_order_page(db: Session, *criteria, after="", before="", limit=PAGE_SIZE, date_from=None, date_to=None,
+                     with_items=True, with_username=True):
+    limit = clamp_limit(limit)
+    criteria = list(criteria)
+    if date_from is not None:
+        criteria.append(Order.date >= date_from)
+    if date_to is not None:
+        criteria.append(Order.date <= date_to)
+
+    after_key = decode_date_key(after)
+    before_key = decode_date_key(before) if after_key is None else None
+    # Paging backwards walks up from the cursor and flips the slice back
+    backwards = before_key is not None
+    key = before_key or after_key
+    if key is not None:
+        criteria.append(_order_seek(key[0], key[1], backwards))
+
+    page = (
+        select(Order.id)
+        .where(*criteria)
+        .order_by(*_order_by(backwards))
+        .limit(limit + 1)
+        .subquery()
+    )
+    columns = [Order.id, Order.user_id, User.username if with_username else null(), Order.date, Order.status,
+               Order.item_count, Order.total_amount]
+    if with_items:
+        columns += [OrderItem.product_id, OrderItem.quantity, OrderItem.unit_price, Product.subcategory, Product.brand]
+    rows = db.query(*columns).select_from(page).join(Order, Order.id == page.c.id)
+    if with_username:
+        rows = rows.outerjoin(User, User.id == Order.user_id)
+    if with_items:
+        rows = (
+            rows.outerjoin(OrderItem, OrderItem.order_id == Order.id)
+            .outerjoin(Product, Product.id == OrderItem.product_id)
+            .order_by(*_order_by(backwards), OrderItem.id)
+        )
+    else:
+        rows = rows.order_by(*_order_by(backwards))
+
+    orders = {}
+    for row in rows:
+        order = orders.get(row[0])
+        if order is None:
+            order = orders[row[0]] = OrderRow(*row[:7])
+        if with_items and row[7] is not None:
+            order.items.append(OrderItemRow(row[7], row[10], row[11], row[8], row[9]))
+
+    orders = list(orders.values())
+    has_more = len(orders) > limit
+    orders = orders[:limit]
+    if backwards:
+        orders.reverse()
+
+    next_cursor = prev_cursor = None
+    if orders:
+        first = encode_date_key(orders[0].date, orders[0].id)
+        last = encode_date_key(orders[-1].date, orders[-1].id)
+        if backwards:
+            prev_cursor = first if has_more else None
+            next_cursor = last
+        else:
+            next_cursor = last if has_more else None
+            prev_cursor = first if after_key is not None else None
+    return Page(orders, "-date", limit, next_cursor=next_cursor, prev_cursor=prev_cursor)
+
+
+def delivered_orders(db: Session, **paging):
+    return fetch_order_page(db, Order.status == "Delivered", **paging)
+
+
+def open_orders(db: Session, **paging):
+    return fetch_order_page(db, Order.status != "Delivered", **paging)
+
+
+def user_orders(db: Session, user_id: int, **paging):
+    return fetch_order_page(db, Order.user_id == user_id, **paging)
+
+
+# Dashboard aggregates: each is a single SUM/COUNT query
+def todays_sales_total(db: Session, today):
+    return db.query(func.coalesce(func.sum(DailySales.revenue), 0.0)).filter(DailySales.day == today).scalar()
+
+
+def low_stock_count(db: Session):
+    return db.query(func.count(LowStock.product_id)).join(Product, Product.id == LowStock.product_id).filter(still_low()).scalar()
+
+
+def customer_purchase_totals(db: Session, user_id: int):
+    # (total quantity, distinct products) over every order the user placed
+    total_quantity, total_products = (
+        db.query(func.coalesce(func.sum(OrderItem.quantity), 0), func.count(func.distinct(OrderItem.product_id)))
+        .join(Order, Order.id == OrderItem.order_id)
+        .filter(Order.user_id == user_id)
+        .one()
+    )
+    return total_quantity, total_products
+
+
+def customer_todays_purchases(db: Session, user_id: int, today):
+    rows = (
+        db.query(Product.subcategory, OrderItem.quantity * func.coalesce(OrderItem.unit_price, Product.price))
+        .select_from(OrderItem)
+        .join(Order, Order.id == OrderItem.order_id)
+        .join(Product, Product.id == OrderItem.product_id)
+        .filter(Order.user_id == user_id, Order.date == today)
+        .all()
+    )
+    return sum(amount for _, amount in rows), [subcategory for subcategory, _ in rows]
@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
+from config import settings
+from models import Product, CartItem
+from checkout import OutOfStock, MAX_RETRIES, is_retryable
+from inventory import refresh_low_stock
+import catalog_cache
+
+logger = logging.getLogger(__name__)
+
+# Adding to a cart moves the stock off Product.quantity onto the cart line (CartItem.reserved)
+# for RESERVATION_TTL seconds. Product.quantity is therefore what is left to sell, a plain
+# indexed column read, and checkout only touches it for quantity the line does not hold.
+
+
+# Stock held in carts for the products row being read or written. Admin figures (the edit form,
+# catalog import and export) are on hand, so they are written as on hand - held and read as quantity + held
+def held_stock():
+    return (
+        select(func.coalesce(func.sum(CartItem.reserved), 0))
+        .where(CartItem.product_id == Product.id)
+        .scalar_subquery()
+    )
+
+
+def _take_stock(db: Session, product_id, quantity):
+    result = db.execute(
+        update(Product)
+        .where(Product.id == product_id, Product.quantity >= quantity)
+        .values(quantity=Product.quantity - quantity)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def _hold(db: Session, user_id, product_id, quantity, until):
+    if not _take_stock(db, product_id, quantity):
+        subcategory = db.query(Product.subcategory).filter(Product.id == product_id).scalar()
+        if subcategory is None:
+            return False
+        raise OutOfStock([subcategory])
+
+    line = (
+        db.query(CartItem)
+        .filter(CartItem.user_id == user_id, CartItem.product_id == product_id)
+        .with_for_update()
+        .first()
+    )
+    if line:
+        line.quantity += quantity
+        line.reserved += quantity
+        line.reserved_until = until
+    else:
+        db.add(CartItem(user_id=user_id, product_id=product_id, quantity=quantity, reserved=quantity, reserved_until=until))
+    db.flush()
+    catalog_cache.touch(db)
+    refresh_low_stock(db, [product_id])
+    return True
+
+
+# Runs work(db) and commits; a unique-key race retries once, lock waits and deadlocks
+# (and "database is locked" on SQLite) back off and retry like checkout does
+def _commit_with_retries(db: Session, work):
+    for attempt in range(MAX_RETRIES):
+        try:
+            result = work(db)
+            db.commit()
+            return result
+        except IntegrityError:
+            # A concurrent request created the line first (unique per user and product); add to it instead
+            db.rollback()
+            if attempt:
+                raise
+        except OperationalError as exc:
+            db.rollback()
+            if not is_retryable(exc) or attempt == MAX_RETRIES - 1:
+                raise
+            time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+        except Exception:
+            db.rollback()
+            raise
+
+
+# Adds quantity to the user's cart line and holds that much stock, extending the hold on what
+# the line already held. Returns False for an unknown product; raises OutOfStock without changing anything.
+def reserve(db: Session, user_id: int, product_id: int, quantity: int, now=None):
+    if quantity < 1:
+        raise ValueError("quantity must be positive")
+    until = (now or datetime.now()) + timedelta(seconds=settings.RESERVATION_TTL)
+    return _commit_with_retries(db, lambda session: _hold(session, user_id, product_id, quantity, until))
+
+
+# Gives the held stock of (id, product_id, reserved) lines back; the lines stay in their carts.
+# Each line is cleared only if it still holds what was read, and only cleared lines credit their
+# product: a line that a checkout took or deleted since (SQLite takes no lock on the read) returns
+# nothing. Cart lines before products, the order checkout locks them in. Returns the lines released.
+def _release(db: Session, lines):
+    returned = {}
+    released = 0
+    for line_id, product_id, reserved in lines:
+        result = db.execute(
+            update(CartItem)
+            .where(CartItem.id == line_id, CartItem.reserved == reserved)
+            .values(reserved=0, reserved_until=None)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 1:
+            released += 1
+            if reserved:
+                returned[product_id] = returned.get(product_id, 0) + reserved
+    # Product id order, so concurrent releases and checkouts lock rows consistently
+    for product_id in sorted(returned):
+        db.execute(
+            update(Product)
+            .where(Product.id == product_id)
+            .values(quantity=Product.quantity + returned[product_id])
+            .execution_options(synchronize_session=False)
+        )
+    if returned:
+        catalog_cache.touch(db)
+        refresh_low_stock(db, sorted(returned))
+    return released
+
+
+def _remove(db: Session, cart_id):
+    line = db.query(CartItem.id, CartItem.product_id, CartItem.reserved).filter(CartItem.id == cart_id).with_for_update().first()
+    if line is None:
+        return False
+    _release(db, [line])
+    db.query(CartItem).filter(CartItem.id == cart_id).delete(synchronize_session=False)
+    return True
+
+
+# Deletes a cart line, returning whatever it held
+def remove_cart_line(db: Session, cart_id: int):
+    return _commit_with_retries(db, lambda session: _remove(session, cart_id))
+
+
+# Releases holds that expired by now, batch lines per transaction; returns how many lines.
+# Lines locked by a checkout in progress are skipped (MySQL) and picked up by the next sweep.
+def release_expired(db: Session, now=None, batch=None):
+    now = now or datetime.now()
+    batch = batch or settings.RESERVATION_SWEEP_BATCH
+    released = 0
+    while True:
+        lines = (
+            db.query(CartItem.id, CartItem.product_id, CartItem.reserved)
+            .filter(CartItem.reserved_until <= now)
+            .order_by(CartItem.reserved_until)
+            .limit(batch)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        if not lines:
+            return released
+        try:
+            released += _release(db, lines)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        if len(lines) < batch:
+            return released
+
+
+def _sweep(session_factory):
+    with session_factory() as db:
+        released = release_expired(db)
+    if released:
+        logger.info("released %d expired stock reservations", released)
+
+
+# Background task started by the app lifespan; each worker runs one, skip-locked batches keep them apart
+async def run_sweeper(session_factory, interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(_sweep, session_factory)
+        except Exception:
+            logger.exception("stock reservation sweep failed")
@@ -0,0 +1,74 @@
+from sqlalchemy import func
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from models import Product, Order, OrderItem, DailySales
+
+
+def _upsert(db: Session, rows):
+    # Add to existing (day, product) counters instead of overwriting them
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        stmt = mysql_insert(DailySales).values(rows)
+        stmt = stmt.on_duplicate_key_update(
+            units=DailySales.units + stmt.inserted.units,
+            revenue=DailySales.revenue + stmt.inserted.revenue,
+        )
+    elif dialect == "sqlite":
+        stmt = sqlite_insert(DailySales).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[DailySales.day, DailySales.product_id],
+            set_={
+                "units": DailySales.units + stmt.excluded.units,
+                "revenue": DailySales.revenue + stmt.excluded.revenue,
+            },
+        )
+    else:
+        for row in rows:
+            existing = db.get(DailySales, (row["day"], row["product_id"]))
+            if existing:
+                existing.units += row["units"]
+                existing.revenue += row["revenue"]
+            else:
+                db.add(DailySales(**row))
+        return
+    db.execute(stmt)
+
+
+# lines: iterable of (product_id, units, unit_price); joins the caller's transaction
+def record_sales(db: Session, day, lines):
+    totals = {}
+    for product_id, units, unit_price in lines:
+        current = totals.setdefault(product_id, [0, 0.0])
+        current[0] += units
+        current[1] += units * unit_price
+    if totals:
+        _upsert(db, [
+            {"day": day, "product_id": product_id, "units": units, "revenue": revenue}
+            for product_id, (units, revenue) in totals.items()
+        ])
+
+
+# One-off backfill for orders placed before the rollup existed
+def rebuild_daily_sales(db: Session):
+    db.query(DailySales).delete(synchronize_session=False)
+    rows = (
+        db.query(Order.date, OrderItem.product_id, func.sum(OrderItem.quantity),
+                 func.sum(OrderItem.quantity * func.coalesce(OrderItem.unit_price, Product.price)))
+        .join(OrderItem, OrderItem.order_id == Order.id)
+        .join(Product, Product.id == OrderItem.product_id)
+        .filter(Order.date.isnot(None))
+        .group_by(Order.date, OrderItem.product_id)
+        .all()
+    )
+    if rows:
+        _upsert(db, [
+            {"day": day, "product_id": product_id, "units": units or 0, "revenue": revenue or 0.0}
+            for day, product_id, units, revenue in rows
+        ])
+    db.commit()
+
+
+def backfill_if_empty(db: Session):
+    if db.query(DailySales.day).first() is None and db.query(OrderItem.id).first() is not None:
+        rebuild_daily_sales(db)
@@ -0,0 +1,372 @@
+import base64
+import math
+import re
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections import defaultdict
+from sqlalchemy import Float, Integer, false, literal, or_, select, text
+from sqlalchemy.dialects.mysql import match
+from sqlalchemy.exc import OperationalError
+from database import database_key
+from models import Product
+from pagination import Page, clamp_limit, PAGE_SIZE
+
+SEARCH_COLUMNS = ("category", "subcategory", "brand", "desc")
+
+# InnoDB's built-in stopword list; FULLTEXT indexes leave these words out
+INNODB_STOPWORDS = frozenset((
+    "a", "about", "an", "are", "as", "at", "be", "by", "com", "de", "en", "for", "from", "how", "i", "in", "is",
+    "it", "la", "of", "on", "or", "that", "the", "this", "to", "was", "what", "when", "where", "who", "will",
+    "with", "und", "www",
+))
+
+_token_re = re.compile(r"\w+", re.UNICODE)
+_number_re = re.compile(r"\d+(\.\d+)?")
+
+
+def tokenize(value):
+    return _token_re.findall((value or "").lower())
+
+
+def _parse_float(value):
+    try:
+        return float(value) if value not in (None, "") else None
+    except ValueError:
+        return None
+
+
+# Structured filters applied on top of (or instead of) the text match
+class SearchFilters:
+    def __init__(self, min_price=None, max_price=None, category="", in_stock=False):
+        self.min_price = min_price
+        self.max_price = max_price
+        self.category = category or ""
+        self.in_stock = bool(in_stock)
+
+    @classmethod
+    def from_params(cls, min_price="", max_price="", category="", in_stock=""):
+        return cls(_parse_float(min_price), _parse_float(max_price), category.strip(), in_stock in ("1", "on", "true"))
+
+    def apply(self, query):
+        if self.min_price is not None:
+            query = query.filter(Product.price >= self.min_price)
+        if self.max_price is not None:
+            query = query.filter(Product.price <= self.max_price)
+        if self.category:
+            query = query.filter(Product.category == self.category)
+        if self.in_stock:
+            query = query.filter(Product.quantity > 0)
+        return query
+
+    def params(self):
+        # Query-string form, used to carry filters across page links
+        params = {}
+        if self.min_price is not None:
+            params["min_price"] = self.min_price
+        if self.max_price is not None:
+            params["max_price"] = self.max_price
+        if self.category:
+            params["category"] = self.category
+        if self.in_stock:
+            params["in_stock"] = "1"
+        return params
+
+
+# A bare number may be a product id, a price or a stock level, none of which the text indexes cover
+def _numeric_conditions(search):
+    value = search.strip()
+    if not _number_re.fullmatch(value):
+        return []
+    number = float(value)
+    # Prices are single-precision floats on MySQL, so compare to the cent rather than exactly
+    conditions = [Product.price.between(number - 0.005, number + 0.005)]
+    if number.is_integer():
+        conditions += [Product.id == int(number), Product.quantity == int(number)]
+    return conditions
+
+
+def _exact_id(search):
+    value = search.strip()
+    return int(value) if value.isdigit() else None
+
+
+def _offset_page(items, start, limit, has_more):
+    next_cursor = _encode_offset(start + limit) if has_more else None
+    prev_cursor = _encode_offset(start) if start > 0 else None
+    return Page(items, "relevance", limit, next_cursor=next_cursor, prev_cursor=prev_cursor)
+
+
+# FULLTEXT and FTS5 indexes are created by migrations (step 6), so searching only ever reads.
+# Matches are joined into the caller's query, so filters, sorting and paging run in the same statement
+class SearchBackend(ABC):
+    name = "base"
+
+    # Load any in-process state the backend needs; runs on every search and must not write
+    def _ensure(self, db):
+        pass
+
+    # SELECT of (id, score) over the products matching every term; a higher score is more relevant
+    @abstractmethod
+    def scores(self, db, terms):
+        pass
+
+    # Restrict a Product query to the matches; returns it with its relevance ORDER BY
+    def matching(self, db, query, search):
+        terms = tokenize(search)
+        conditions = _numeric_conditions(search)
+        order = []
+        exact = _exact_id(search)
+        if exact is not None:
+            order.append((Product.id == exact).desc())
+        if terms:
+            self._ensure(db)
+            matches = self.scores(db, terms).subquery("matches")
+            query = query.outerjoin(matches, matches.c.id == Product.id)
+            conditions.append(matches.c.id.isnot(None))
+            # Rows found only by number have no score and sort after text matches
+            order.append(matches.c.score.desc())
+        if not conditions:
+            return query.filter(false()), [Product.id.asc()]
+        return query.filter(or_(*conditions)), order + [Product.id.asc()]
+
+    # Ids of every match in relevance order
+    def search(self, db, search):
+        query, order = self.matching(db, db.query(Product.id), search)
+        return [product_id for (product_id,) in query.order_by(*order)]
+
+    # Relevance order can't be expressed as a keyset, so pages are addressed by offset
+    def ranked_page(self, db, query, search, after="", before="", limit=PAGE_SIZE):
+        start, limit = _page_window(after, before, limit)
+        query, order = self.matching(db, query, search)
+        rows = query.order_by(*order).offset(start).limit(limit + 1).all()
+        return _offset_page(rows[:limit], start, limit, len(rows) > limit)
+
+    # Drop any in-process state after bulk writes that bypassed index_product
+    def invalidate(self):
+        pass
+
+    # Keep the index in step with product writes; DB-maintained indexes ignore these
+    def index_product(self, db, product):
+        pass
+
+    def remove_product(self, db, product_id):
+        pass
+
+
+def _word_prefix(term):
+    pattern = term.replace("_", "\\_")
+    return or_(*(
+        condition
+        for column in SEARCH_COLUMNS
+        for condition in (getattr(Product, column).like(f"{pattern}%", escape="\\"),
+                          getattr(Product, column).like(f"% {pattern}%", escape="\\"))
+    ))
+
+
+# MySQL: InnoDB FULLTEXT index queried in boolean mode
+class MySQLFullTextBackend(SearchBackend):
+    name = "mysql"
+
+    def __init__(self):
+        self._min_token_size = None
+
+    def _ensure(self, db):
+        if self._min_token_size is None:
+            self._min_token_size = db.execute(text("SELECT @@innodb_ft_min_token_size")).scalar()
+
+    # Words shorter than the minimum token size and stopwords never reach the index
+    def _indexed(self, term):
+        return len(term) >= self._min_token_size and term not in INNODB_STOPWORDS
+
+    def scores(self, db, terms):
+        indexed = [term for term in terms if self._indexed(term)]
+        # Terms the index can't answer fall back to matching the start of a word
+        conditions = [_word_prefix(term) for term in terms if not self._indexed(term)]
+        score = literal(0.0)
+        if indexed:
+            score = match(*(getattr(Product, column) for column in SEARCH_COLUMNS),
+                          against=" ".join(f"+{term}*" for term in indexed)).in_boolean_mode()
+            conditions.append(score)
+        return select(Product.id.label("id"), score.label("score")).where(*conditions)
+
+
+# SQLite: external-content FTS5 table kept in sync by triggers
+class SQLiteFTS5Backend(SearchBackend):
+    name = "fts5"
+
+    def scores(self, db, terms):
+        # bm25() is lower for better matches
+        return text(
+            "SELECT rowid AS id, -bm25(products_fts) AS score FROM products_fts WHERE products_fts MATCH :q"
+        ).bindparams(q=" ".join(f'"{term}"*' for term in terms)).columns(id=Integer, score=Float)
+
+
+# Fallback: in-process inverted index with TF-IDF ranking and prefix matching
+class InvertedIndexBackend(SearchBackend):
+    name = "memory"
+
+    def __init__(self):
+        self._prepared = set()
+        self._lock = threading.Lock()
+        self._postings = defaultdict(dict)   # token -> {product_id: term frequency}
+        self._doc_tokens = {}                # product_id -> tokens, for removal
+        self._vocabulary = []                # sorted tokens, for prefix lookups
+
+    def _ensure(self, db):
+        key = database_key(db.get_bind())
+        if key in self._prepared:
+            return
+        # No lock around setup: under run_sync its queries hand the event loop to other requests
+        # on this same thread, and one of them blocking on the lock would hang the loop for good
+        self.setup(db)
+        with self._lock:
+            self._prepared.add(key)
+
+    # Safe to run more than once, including concurrently
+    def setup(self, db):
+        # Read first, then index under the lock; re-adding a product replaces its old entry
+        rows = db.query(Product.id, *(getattr(Product, column) for column in SEARCH_COLUMNS)).all()
+        with self._lock:
+            for product_id, *values in rows:
+                self._add_tokens(product_id, [token for value in values for token in tokenize(value)])
+
+    def _add(self, product):
+        self._add_tokens(product.id, [token for column in SEARCH_COLUMNS for token in tokenize(getattr(product, column))])
+
+    def _add_tokens(self, product_id, tokens):
+        self._drop(product_id)
+        self._doc_tokens[product_id] = set(tokens)
+        for token in tokens:
+            postings = self._postings[token]
+            if not postings:
+                index = bisect_left(self._vocabulary, token)
+                if index == len(self._vocabulary) or self._vocabulary[index] != token:
+                    self._vocabulary.insert(index, token)
+            postings[product_id] = postings.get(product_id, 0) + 1
+
+    def _drop(self, product_id):
+        for token in self._doc_tokens.pop(product_id, ()):
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.pop(product_id, None)
+                if not postings:
+                    del self._postings[token]
+                    index = bisect_left(self._vocabulary, token)
+                    if index < len(self._vocabulary) and self._vocabulary[index] == token:
+                        del self._vocabulary[index]
+
+    def _expand(self, prefix):
+        index = bisect_left(self._vocabulary, prefix)
+        while index < len(self._vocabulary) and self._vocabulary[index].startswith(prefix):
+            yield self._vocabulary[index]
+            index += 1
+
+    def _rank(self, terms):
+        total = max(len(self._doc_tokens), 1)
+        scores = None
+        with self._lock:
+            for term in terms:
+                term_scores = defaultdict(float)
+                for token in self._expand(term):
+                    postings = self._postings[token]
+                    idf = math.log(1 + total / len(postings))
+                    for product_id, frequency in postings.items():
+                        term_scores[product_id] += frequency * idf
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {pid: score + term_scores[pid] for pid, score in scores.items() if pid in term_scores}
+                if not scores:
+                    return {}
+        return scores
+
+    def scores(self, db, terms):
+        raise NotImplementedError("the in-memory index ranks in Python")
+
+    # Every match goes into the query, so filters see the whole match set; ranking happens in Python
+    def matching(self, db, query, search):
+        terms = tokenize(search)
+        conditions = _numeric_conditions(search)
+        scores = {}
+        if terms:
+            self._ensure(db)
+            scores = self._rank(terms)
+            if scores:
+                conditions.append(Product.id.in_(list(scores)))
+        if not conditions:
+            return query.filter(false()), scores
+        return query.filter(or_(*conditions)), scores
+
+    def _ranked_ids(self, db, query, search):
+        query, scores = self.matching(db, query, search)
+        exact = _exact_id(search)
+        ids = [product_id for (product_id,) in query.with_entities(Product.id)]
+        return sorted(ids, key=lambda pid: (pid != exact, -scores.get(pid, 0.0), pid))
+
+    def search(self, db, search):
+        return self._ranked_ids(db, db.query(Product), search)
+
+    def ranked_page(self, db, query, search, after="", before="", limit=PAGE_SIZE):
+        start, limit = _page_window(after, before, limit)
+        ids = self._ranked_ids(db, query, search)
+        page_ids = ids[start:start + limit]
+        products = {p.id: p for p in db.query(Product).filter(Product.id.in_(page_ids))} if page_ids else {}
+        return _offset_page([products[pid] for pid in page_ids if pid in products], start, limit, start + limit < len(ids))
+
+    def invalidate(self):
+        with self._lock:
+            self._postings.clear()
+            self._doc_tokens.clear()
+            self._vocabulary.clear()
+            self._prepared.clear()
+
+    def index_product(self, db, product):
+        if self._prepared:
+            with self._lock:
+                self._add(product)
+
+    def remove_product(self, db, product_id):
+        if self._prepared:
+            with self._lock:
+                self._drop(product_id)
+
+
+# Some SQLite builds ship without FTS5; a temp table leaves nothing behind in the database
+def fts5_available(conn):
+    try:
+        conn.exec_driver_sql("CREATE VIRTUAL TABLE temp._fts5_probe USING fts5(x)")
+        conn.exec_driver_sql("DROP TABLE temp._fts5_probe")
+    except OperationalError:
+        return False
+    return True
+
+
+def create_search_backend(engine, backend="auto"):
+    if backend == "auto":
+        backend = {"mysql": "mysql", "sqlite": "fts5"}.get(engine.dialect.name, "memory")
+    if backend == "fts5":
+        with engine.connect() as conn:
+            if not fts5_available(conn):
+                backend = "memory"
+    return {"mysql": MySQLFullTextBackend, "fts5": SQLiteFTS5Backend}.get(backend, InvertedIndexBackend)()
+
+
+def _encode_offset(offset):
+    return base64.urlsafe_b64encode(str(offset).encode()).decode().rstrip("=")
+
+
+def _decode_offset(cursor):
+    try:
+        return max(int(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()), 0)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _page_window(after, before, limit):
+    limit = clamp_limit(limit)
+    start = _decode_offset(after) if after else None
+    if start is None:
+        end = _decode_offset(before) if before else None
+        start = max(end - limit, 0) if end is not None else 0
+    return start, limit